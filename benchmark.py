@@ -0,0 +1,235 @@
+'''Benchmarks of the model and filter hot paths on synthetic catalogs.
+
+Run as python benchmark.py -o results.json, then compare the json of two runs.
+Catalogs are generated from a fixed seed, with a skewed tag distribution: a few tags are on
+many fonts and most tags on a few, or the distribution of an existing tags file with --like.'''
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from fontmodel import FontCatModel
+from fontquery import ALL_FONTS, compile_query
+from fontstore import open_store
+
+try:
+    from fontfacets import TagFacets
+except ImportError:
+    TagFacets = None
+
+
+# (number of fonts, number of tags)
+DEFAULT_CATALOGS = ((1000, 10), (10000, 500), (100000, 5000))
+
+
+def get_tag_weights(num_tags, like=None):
+    '''Returns list of weights of num_tags tags, and mean number of tags per font.
+    Without like, weights follow Zipf's law and fonts have 3 tags on average.'''
+    if like is None:
+        return [1 / (rank + 1) for rank in range(num_tags)], 3
+    with open(like) as tags_file:
+        tags_list = json.load(tags_file)
+    counts = sorted((len(fonts) for fonts in tags_list.values()), reverse=True) or [1]
+    tagged = {font for fonts in tags_list.values() for font in fonts}
+    mean_tags = sum(counts) / max(len(tagged), 1)
+    # stretch the ranked counts over num_tags
+    return [counts[rank * len(counts) // num_tags] or 1 for rank in range(num_tags)], mean_tags
+
+
+def make_catalog(num_fonts, num_tags, like=None, seed=0):
+    '''Returns list of font names and dict of tag to list of fonts, in the tags file format.'''
+    rng = random.Random(seed)
+    fonts = [f'Synthetic Font {i}' for i in range(num_fonts)]
+    tags = [f'tag{i}' for i in range(num_tags)]
+    weights, mean_tags = get_tag_weights(num_tags, like)
+    tags_list = {tag: [] for tag in tags}
+    for font in fonts:
+        count = min(num_tags, int(rng.expovariate(1 / mean_tags) + 0.5))
+        for tag in set(rng.choices(tags, weights, k=count)):
+            tags_list[tag].append(font)
+    return fonts, tags_list
+
+
+def time_runs(func, repeat, setup=None):
+    '''Returns dict of min and median seconds of repeat runs of func, calling setup before each.'''
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times)}
+
+
+def write_catalog(filename, backend, tags_list):
+    store = open_store(filename, backend)
+    store.import_tags(tags_list)
+    store.close()
+
+
+def bench_catalog(num_fonts, num_tags, backend, repeat, like, tmp_dir):
+    fonts, tags_list = make_catalog(num_fonts, num_tags, like)
+    ranked = sorted(tags_list, key=lambda tag: -len(tags_list[tag]))
+    common, middle, rare = ranked[0], ranked[len(ranked) // 2], ranked[-1]
+    queries = {
+        'all': ALL_FONTS,
+        'common': f'{{{common}}}',
+        'rare': f'{{{rare}}}',
+        'and': f'{{{common}}} & {{{middle}}}',
+        'or': f'{{{middle}}} | {{{rare}}}',
+        'not': f'!{{{common}}}',
+        'nested': f'({{{common}}} | {{{middle}}}) & !{{{rare}}}',
+        'name': f'synthetic font {num_fonts // 2}',
+        'name_typo': f'synthetc fnt {num_fonts // 2}',
+        'name_and': f'font {num_fonts // 2} & {{{common}}}',
+    }
+    filename = os.path.join(tmp_dir, f'tags-{num_fonts}-{num_tags}' +
+                            ('.db' if backend == 'sqlite' else '.json'))
+    result = {'fonts': num_fonts, 'tags': num_tags, 'backend': backend,
+              'tagged': sum(len(tag_fonts) for tag_fonts in tags_list.values())}
+
+    def load():
+        model = FontCatModel(fonts, filename, backend)
+        model.store.close()
+        return model
+
+    write_catalog(filename, backend, tags_list)
+    result['load_file'] = time_runs(load, repeat)
+    tracemalloc.start()
+    model = FontCatModel(fonts, filename, backend)
+    result['load_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # the name index is made by the first free text query
+    result['name_index'] = time_runs(lambda: model.get_filtered_fonts(queries['name']), repeat,
+                                     lambda: model.clear_caches(name_index=True))
+
+    result['get_filtered_fonts'] = {
+        name: time_runs(lambda: model.get_filtered_fonts(query), repeat, model.clear_caches)
+        for name, query in queries.items()}
+    result['get_filtered_fonts_cached'] = {
+        name: time_runs(lambda: model.get_filtered_fonts(query), repeat)
+        for name, query in queries.items()}
+
+    # queries tested against the plain tag lists of fonts, which name and fact terms never
+    # match, so only the tag queries are timed
+    font_tags = [model.get_font_tags(font) for font in fonts[:10000]]
+    result['matches_tags_per_font'] = {
+        name: {stat: seconds / len(font_tags) for stat, seconds in time_runs(
+            lambda: [compile_query(query).matches(tags) for tags in font_tags], repeat).items()}
+        for name, query in queries.items() if not name.startswith('name')}
+
+    if TagFacets is not None:
+        def set_facets():
+            facets = TagFacets()
+            facets.fill(model.get_facet_cells())
+            model.set_facets(facets)
+
+        # facets are kept up to date by the edits below too
+        result['set_facets'] = time_runs(set_facets, repeat)
+        result['get_tag_counts'] = {
+            name: time_runs(lambda: model.get_tag_counts(query), repeat)
+            for name, query in queries.items()}
+
+    # the tag completions are made by the first one, then kept up to date by the edits below
+    model.complete_tag('')
+    prefixes = [tag[:length] for tag in ranked[:100] for length in range(len(tag) + 1)]
+    result['complete_tag_per_key'] = {stat: seconds / len(prefixes) for stat, seconds in time_runs(
+        lambda: [model.complete_tag(prefix) for prefix in prefixes], repeat).items()}
+
+    rng = random.Random(1)
+    edits = [(rng.choice(fonts), rng.choice(ranked)) for _ in range(1000)]
+
+    def add_all():
+        for font, tag in edits:
+            model.add_tag(font, tag)
+
+    def rmv_all():
+        for font, tag in edits:
+            model.rmv_tag(font, tag)
+
+    result['add_tag_per_call'] = {stat: seconds / len(edits) for stat, seconds in
+                                  time_runs(add_all, repeat, rmv_all).items()}
+    result['rmv_tag_per_call'] = {stat: seconds / len(edits) for stat, seconds in
+                                  time_runs(rmv_all, repeat, add_all).items()}
+    result['save_file'] = time_runs(model.save_file, repeat)
+
+    removed = iter(ranked[1:])
+    result['remove_tag_from_all'] = time_runs(lambda: model.remove_tag_from_all(next(removed)),
+                                              min(repeat, len(ranked) - 1))
+    model.store.close()
+    return result
+
+
+def bench_widgets(num_fonts, repeat):
+    '''Times building the flowbox of fonts, with cards of a bare model and no window, so no
+    session, preview cache or background threads. Returns None if GTK can not be initialized.'''
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import Gtk
+    if not Gtk.init_check()[0]:
+        return None
+    from fontwindow import FontBox
+
+    fonts, _ = make_catalog(num_fonts, 10)
+    model = FontCatModel(fonts, None)
+    # all the cards read from their window, without previews they show labels in the font
+    parent = Gtk.Window()
+    parent.thumbnails = None
+    parent.selected_fonts = set()
+    flowboxes = []
+
+    def build_flowbox():
+        flowbox = Gtk.FlowBox()
+        for font_name in model.get_all_fonts():
+            flowbox.add(FontBox(parent_window=parent, font_name=font_name, font_model=model))
+        flowboxes.append(flowbox)
+
+    times = time_runs(build_flowbox, repeat)
+    for flowbox in flowboxes:
+        flowbox.destroy()
+    parent.destroy()
+    return {'fonts': num_fonts, 'build_flowbox': times}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the font model on synthetic catalogs.')
+    parser.add_argument('-o', '--output', help='json file for the results, stdout by default')
+    parser.add_argument('-c', '--catalog', action='append', metavar='FONTS:TAGS',
+                        help='catalog size, can be repeated (default 1000:10, 10000:500, 100000:5000)')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--backend', choices=('json', 'snapshot', 'sqlite'), default='json')
+    parser.add_argument('--like', help='tags file to copy the tag distribution from')
+    parser.add_argument('--widgets', action='store_true',
+                        help='also time building the flowbox, needs a display')
+    parser.add_argument('--widget-fonts', type=int, default=2000)
+    args = parser.parse_args()
+
+    catalogs = DEFAULT_CATALOGS
+    if args.catalog:
+        catalogs = [tuple(int(n) for n in catalog.split(':')) for catalog in args.catalog]
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat, 'catalogs': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_fonts, num_tags in catalogs:
+            results['catalogs'].append(bench_catalog(num_fonts, num_tags, args.backend,
+                                                     args.repeat, args.like, tmp_dir))
+    if args.widgets:
+        results['widgets'] = bench_widgets(args.widget_fonts, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,18 @@
 import gi
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
+
+import fontstats
 
 
 class EntryDialog(Gtk.Dialog):
-    def __init__(self, parent, title, prompt='', default='', reset=None, valid_func=None):
+    def __init__(self, parent, title, prompt='', default='', reset=None, valid_func=None,
+                 complete_func=None):
+        '''complete_func : called with the text typed so far, returns list of completions'''
         super().__init__(title=title, transient_for=parent, flags=0)
         self.reset_val = reset
         self.valid_func = valid_func
+        self.complete_func = complete_func
         self.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
                          Gtk.STOCK_OK, Gtk.ResponseType.OK)
         self.set_default_size(150, 100)
@@ -15,6 +20,14 @@ class EntryDialog(Gtk.Dialog):
         user_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
         self.user_entry = Gtk.Entry()
         self.user_entry.connect('changed', self.set_sensitivity)
+        if complete_func is not None:
+            # refilled before the completion filters it on the same key
+            self.completion_store = Gtk.ListStore(str)
+            self.user_entry.connect('changed', self.set_completions)
+            completion = Gtk.EntryCompletion(model=self.completion_store, text_column=0)
+            # the store only holds completions of the text
+            completion.set_match_func(lambda *args: True)
+            self.user_entry.set_completion(completion)
         self.user_entry.set_text(default)
         user_box.pack_start(self.user_entry, True, True, 6)
         if reset is not None:
@@ -37,5 +50,67 @@ class EntryDialog(Gtk.Dialog):
             self.set_response_sensitive(
                 Gtk.ResponseType.OK, self.valid_func(entry.get_text()))
 
+    def set_completions(self, entry):
+        self.completion_store.clear()
+        for completion in self.complete_func(entry.get_text()):
+            self.completion_store.append([completion])
+
     def run(self):
-        return super().run(), self.user_entry.get_text()
\ No newline at end of file
+        return super().run(), self.user_entry.get_text()
+
+
+class StatsDialog(Gtk.Dialog):
+    '''Shows the collected timings and counters, see fontstats.'''
+
+    def __init__(self, parent):
+        super().__init__(title="Timings", transient_for=parent, flags=0)
+        self.add_buttons("_Reset", Gtk.ResponseType.REJECT,
+                         "_Save JSON", Gtk.ResponseType.APPLY,
+                         Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
+        self.set_default_size(600, 400)
+
+        self.label = Gtk.Label(selectable=True, xalign=0, yalign=0)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(self.label)
+        box = self.get_content_area()
+        box.pack_start(scrolled, True, True, 6)
+        self.reload()
+        self.show_all()
+
+    def reload(self):
+        stats = fontstats.get_stats()
+        lines = [f"{'operation':<24}{'calls':>8}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for name, operation in sorted(stats['operations'].items()):
+            lines.append(f"{name:<24}{operation['calls']:>8}{operation['mean_ms']:>10.2f}"
+                         f"{operation['p95_ms']:>10.2f}{operation['max_ms']:>10.2f}")
+        lines.append('')
+        for name, value in sorted(stats['counters'].items()):
+            lines.append(f"{name:<24}{value:>8}")
+        if not stats['enabled']:
+            lines.append('\nTimings are off, turn them on from the menu.')
+        self.label.set_markup(f"<tt>{GLib.markup_escape_text(chr(10).join(lines))}</tt>")
+
+    def run(self):
+        '''Runs until closed, resetting or saving the stats as asked.'''
+        while True:
+            response = super().run()
+            if response == Gtk.ResponseType.REJECT:
+                fontstats.reset()
+                self.reload()
+            elif response == Gtk.ResponseType.APPLY:
+                save_stats(self)
+            else:
+                return response
+
+
+def save_stats(parent):
+    '''Asks for a file and dumps the stats to it as json.'''
+    chooser = Gtk.FileChooserDialog(title="Save Timings", transient_for=parent,
+                                    action=Gtk.FileChooserAction.SAVE)
+    chooser.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                        Gtk.STOCK_SAVE, Gtk.ResponseType.OK)
+    chooser.set_do_overwrite_confirmation(True)
+    chooser.set_current_name("fontcat-timings.json")
+    if chooser.run() == Gtk.ResponseType.OK:
+        fontstats.dump(chooser.get_filename())
+    chooser.destroy()
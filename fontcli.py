@@ -0,0 +1,173 @@
+'''Command line access to the font tags, for scripts.
+
+Only the model is imported, so this starts without loading GTK. Fonts are listed from the
+list the window saves on each start, and only if there is none, or for --refresh, the way the
+window lists them, see fontfiles.list_system_fonts.'''
+import argparse
+import json
+import sys
+
+from fontfiles import read_font_list_cache, write_font_list_cache, list_system_fonts
+from fontmodel import FontCatModel
+from fontquery import ALL_FONTS, QueryError, parse_query
+from fontstore import StoreLockedError, open_store
+
+
+# changes are only journaled, until the journal has this many records and the tags file is
+# written again
+MAX_JOURNAL_RECORDS = 1000
+
+
+def list_fonts(refresh=False):
+    '''Returns list of system fonts, from the cached list unless refresh.'''
+    font_list = None if refresh else read_font_list_cache()
+    if font_list is None:
+        font_list = list_system_fonts()
+        write_font_list_cache(font_list)
+    return font_list
+
+
+def get_target_fonts(font_model, args):
+    '''Returns fonts named in args, or read from stdin for '-', and fonts matching args.query.'''
+    fonts = []
+    for font in args.fonts:
+        if font == '-':
+            fonts.extend(line.strip() for line in sys.stdin if line.strip())
+        else:
+            fonts.append(font)
+    if args.query is not None:
+        fonts.extend(font_model.get_filtered_fonts(args.query))
+    return fonts
+
+
+def query_fonts(font_model, args):
+    write_fonts(font_model.get_filtered_fonts(args.query), args.format, sys.stdout)
+
+
+def export_fonts(font_model, args):
+    with open(args.output, 'w') as output_file:
+        write_fonts(font_model.get_filtered_fonts(args.query), args.format, output_file)
+
+
+def write_fonts(fonts, format, output_file):
+    if format == 'json':
+        json.dump(fonts, output_file)
+        output_file.write('\n')
+    else:
+        for font in fonts:
+            output_file.write(font + '\n')
+
+
+def add_tags(font_model, args):
+    font_model.add_tag_to_fonts(get_target_fonts(font_model, args), args.tag)
+
+
+def rmv_tags(font_model, args):
+    font_model.rmv_tag_from_fonts(get_target_fonts(font_model, args), args.tag)
+
+
+def remove_tag(font_model, args):
+    font_model.remove_tag_from_all(args.tag)
+
+
+def list_tags(font_model, args):
+    counts = font_model.get_all_tag_counts()
+    if args.format == 'json':
+        json.dump(counts, sys.stdout)
+        sys.stdout.write('\n')
+    else:
+        for tag, count in sorted(counts.items(), key=lambda item: -item[1]):
+            print(f'{count}\t{tag}')
+
+
+def convert_tags(args):
+    '''Copies tags to a json tags file, a snapshot or an SQLite database, by the extension of
+    the output. A snapshot named after a json tags file plus .snap is kept next to it.'''
+    font_model = FontCatModel([], args.tags)
+    tags_list = font_model.get_tags_list()
+    font_model.store.close()
+    if args.output == args.tags + '.snap':
+        store = open_store(args.tags, 'snapshot')
+    else:
+        store = open_store(args.output)
+    store.lock()
+    store.import_tags(tags_list)
+    store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query and tag fonts without the window.')
+    parser.add_argument('--tags', default='tags.json', help='tags file or database')
+    parser.add_argument('--refresh', action='store_true',
+                        help='list the fonts again instead of using the cached font list')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # (function, whether it needs the list of system fonts, whether it changes tags)
+    handlers = {}
+
+    def add_command(name, func, needs_fonts, changes_tags, help):
+        handlers[name] = (func, needs_fonts, changes_tags)
+        return commands.add_parser(name, help=help)
+
+    command = add_command('query', query_fonts, True, False, 'print fonts matching a query')
+    command.add_argument('query', nargs='?', default=ALL_FONTS)
+    command.add_argument('--format', choices=('text', 'json'), default='text')
+
+    command = add_command('export', export_fonts, True, False,
+                          'write fonts matching a query to a file')
+    command.add_argument('output')
+    command.add_argument('query', nargs='?', default=ALL_FONTS)
+    command.add_argument('--format', choices=('text', 'json'), default='text')
+
+    for name, func, help in (('add', add_tags, 'add a tag to fonts'),
+                             ('rmv', rmv_tags, 'remove a tag from fonts')):
+        command = add_command(name, func, False, True, help)
+        command.add_argument('tag')
+        command.add_argument('fonts', nargs='*', help="font names, or - to read them from stdin")
+        command.add_argument('-q', '--query', help='also the fonts matching query')
+
+    command = add_command('remove-tag', remove_tag, False, True, 'remove a tag from all fonts')
+    command.add_argument('tag')
+
+    command = add_command('tags', list_tags, False, False, 'print tags with their font counts')
+    command.add_argument('--format', choices=('text', 'json'), default='text')
+
+    command = commands.add_parser('convert',
+                                  help='copy the tags to a json file, snapshot or database')
+    command.add_argument('output')
+
+    args = parser.parse_args(argv)
+    if args.command == 'convert':
+        try:
+            convert_tags(args)
+        except StoreLockedError as error:
+            parser.error(str(error))
+        return
+
+    func, needs_fonts, changes_tags = handlers[args.command]
+    # invalid queries match no fonts, which would hide a mistake in a script
+    if getattr(args, 'query', None) is not None:
+        try:
+            parse_query(args.query)
+        except QueryError as error:
+            parser.error(f"invalid query {args.query!r}: {error}")
+    # fonts are only listed for queries, tags of fonts not listed are kept all the same
+    if getattr(args, 'query', None) is not None:
+        needs_fonts = True
+    try:
+        font_model = FontCatModel(list_fonts(args.refresh) if needs_fonts else [], args.tags,
+                                  lock=changes_tags)
+    except StoreLockedError as error:
+        parser.error(str(error))
+    if '[' in (getattr(args, 'query', None) or ''):
+        # facts as last read by the window, the font files are not read here
+        from fontmeta import FontMetaIndex
+        font_model.set_font_facts(FontMetaIndex().get_family_facts())
+    func(font_model, args)
+    if changes_tags and font_model.store.changes >= MAX_JOURNAL_RECORDS:
+        font_model.save_file()
+    font_model.store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import bisect
+import heapq
+
+
+class TagCompletions:
+    '''Prefix index of tags, for completing tags as they are typed, most used first.
+
+    Tags are kept sorted by their case folded text, so the tags starting with a prefix are a
+    slice found by bisection, and sorted by count. A short prefix matches many tags, and then
+    walking the tags by count finds the most used matches sooner than ranking the whole slice.
+    Both lists are updated a tag at a time as counts change.'''
+
+    # prefixes matching more tags than this walk the tags by count
+    MAX_RANKED = 100
+
+    def __init__(self, counts=()):
+        self._counts = dict((tag, count) for tag, count in counts if count > 0)
+        self._by_key = sorted((tag.casefold(), tag) for tag in self._counts)
+        self._by_count = sorted((-count, tag.casefold(), tag) for tag, count in self._counts.items())
+
+    def __len__(self):
+        return len(self._counts)
+
+    def set_count(self, tag, count):
+        '''Sets number of fonts with tag, removing it at 0.'''
+        key = tag.casefold()
+        old_count = self._counts.pop(tag, None)
+        if old_count is not None:
+            del self._by_count[bisect.bisect_left(self._by_count, (-old_count, key, tag))]
+            if count <= 0:
+                del self._by_key[bisect.bisect_left(self._by_key, (key, tag))]
+        elif count > 0:
+            bisect.insort(self._by_key, (key, tag))
+        if count > 0:
+            self._counts[tag] = count
+            bisect.insort(self._by_count, (-count, key, tag))
+
+    def complete(self, prefix, limit=10, exclude=()):
+        '''Returns up to limit tags starting with prefix, ignoring case, most used first,
+        leaving out the tags in exclude.'''
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self._by_key, (prefix,))
+        end = bisect.bisect_left(self._by_key, (prefix + '\U0010ffff',), start)
+        if end - start <= self.MAX_RANKED:
+            entries = (entry for entry in self._by_key[start:end] if entry[1] not in exclude)
+            return [tag for _, tag in heapq.nsmallest(
+                limit, entries, key=lambda entry: (-self._counts[entry[1]], entry))]
+        tags = []
+        for _, key, tag in self._by_count:
+            if key.startswith(prefix) and tag not in exclude:
+                tags.append(tag)
+                if len(tags) == limit:
+                    break
+        return tags
@@ -0,0 +1,121 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cairo
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+from fontmodel import FontCatModel
+from fontquery import ALL_FONTS
+from fontfiles import list_system_fonts
+from fontspecimen import SpecimenLayout
+
+
+# page sizes in mm
+PAPER_SIZES = {'a4': (210, 297), 'a3': (297, 420), 'letter': (215.9, 279.4)}
+PT_PER_MM = 72 / 25.4
+
+
+def _create_context(target, page_size, margin):
+    '''Returns PDF surface and a context on it in mm, with the origin at the top left margin.'''
+    width, height = page_size
+    surface = cairo.PDFSurface(target, width * PT_PER_MM, height * PT_PER_MM)
+    cr = cairo.Context(surface)
+    cr.scale(PT_PER_MM, PT_PER_MM)
+    cr.translate(margin, margin)
+    return surface, cr
+
+
+def _render_pages(filename, font_list, settings, pages, page_size, margin):
+    '''Draws pages, already split by paginate in the parent process, to the PDF file filename.'''
+    specimen = SpecimenLayout(font_list, **settings)
+    surface, cr = _create_context(filename, page_size, margin)
+    specimen.prepare(cr, page_size[0] - 2 * margin)
+    specimen.pages = pages
+    for page_num in range(len(pages)):
+        specimen.draw_page(cr, page_num)
+        surface.show_page()
+    surface.finish()
+    return filename
+
+
+def can_merge_pdfs():
+    '''Returns whether merge_pdfs can join several files, with pypdf or pdfunite.'''
+    return PdfWriter is not None or shutil.which('pdfunite') is not None
+
+
+def merge_pdfs(filenames, output):
+    '''Joins PDF files into output in order, with pypdf if installed, otherwise with pdfunite.'''
+    if len(filenames) == 1:
+        shutil.copyfile(filenames[0], output)
+    elif PdfWriter is not None:
+        writer = PdfWriter()
+        for filename in filenames:
+            writer.append(filename)
+        with open(output, 'wb') as output_file:
+            writer.write(output_file)
+    else:
+        subprocess.run(['pdfunite', *filenames, output], check=True)
+
+
+def export_pdf(output, font_model, query=ALL_FONTS, columns=3, view_size=None, view_text=None,
+               paper='a4', margin=10, workers=None):
+    '''Writes a specimen of the fonts matching query to the PDF file output, without a print
+    dialog. The fonts are measured and split into pages here, then runs of pages are drawn by
+    a pool of processes and joined in page order. Without pypdf or pdfunite to join them,
+    one process draws all the pages. Returns number of pages.'''
+    font_list = font_model.get_filtered_fonts(query)
+    settings = dict(columns=columns,
+                    view_size=font_model.view_size if view_size is None else view_size,
+                    view_text=font_model.view_text if view_text is None else view_text)
+    page_size = PAPER_SIZES[paper]
+    specimen = SpecimenLayout(font_list, **settings)
+    _, cr = _create_context(None, page_size, margin)
+    num_pages = specimen.paginate(cr, page_size[0] - 2 * margin, page_size[1] - 2 * margin)
+
+    workers = min(workers or os.cpu_count(), num_pages)
+    if not can_merge_pdfs():
+        workers = 1
+    per_worker = -(-num_pages // workers)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # spawn, as forking a process that has Pango loaded is not safe
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_render_pages, os.path.join(tmp_dir, f'{start}.pdf'),
+                                       font_list, settings,
+                                       specimen.pages[start:start + per_worker], page_size, margin)
+                       for start in range(0, num_pages, per_worker)]
+            filenames = [future.result() for future in futures]
+        merge_pdfs(filenames, output)
+    return num_pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a PDF specimen of fonts.')
+    parser.add_argument('output', help='PDF file to write')
+    parser.add_argument('-q', '--query', default=ALL_FONTS, help='filter query, all fonts by default')
+    parser.add_argument('-c', '--columns', type=int, default=3)
+    parser.add_argument('-s', '--size', type=int, default=16, help='size of the view text')
+    parser.add_argument('-t', '--text', default="{font_name}", help='view text, the font name by default')
+    parser.add_argument('--tags', default='tags.json', help='tags file')
+    parser.add_argument('--paper', choices=sorted(PAPER_SIZES), default='a4')
+    parser.add_argument('--margin', type=float, default=10, help='page margin in mm')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    font_model = FontCatModel(list_system_fonts(), args.tags)
+    num_pages = export_pdf(args.output, font_model, args.query, args.columns, args.size, args.text,
+                           args.paper, args.margin, args.workers)
+    print(f'{args.output}: {num_pages} pages')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''Counts of the tags of the fonts of a query, for the tag bar.
+
+Which font has which tag is a fonts x tags boolean matrix, and the tags of a query are counted
+by summing its rows of the fonts of the query. Fonts have few of the many tags, so the matrix
+is kept sparse, as NumPy arrays of the font and the tag of each cell that is set, and the sum
+is one bincount of the tags of the cells, weighed by whether their font is in the query.
+The matrix is filled at once, in the background, then cells are set and cleared one at a
+time as tags change.'''
+import numpy as np
+
+
+class TagFacets:
+    '''Sparse fonts x tags boolean matrix of font ids and tag ids, see FontCatModel.set_facets.'''
+
+    def __init__(self, capacity=1024):
+        # intp, so they index without a conversion
+        self._fonts = np.zeros(capacity, dtype=np.intp)
+        self._tags = np.zeros(capacity, dtype=np.intp)
+        self._size = 0
+        # index into the arrays of each set cell, by (font id, tag id)
+        self._cells = {}
+        self._num_fonts = 0
+        self._num_tags = 0
+
+    def __len__(self):
+        return self._size
+
+    def set(self, font_id, tag_id):
+        if (font_id, tag_id) in self._cells:
+            return
+        if self._size == len(self._fonts):
+            self._fonts = np.concatenate([self._fonts, np.zeros_like(self._fonts)])
+            self._tags = np.concatenate([self._tags, np.zeros_like(self._tags)])
+        self._fonts[self._size] = font_id
+        self._tags[self._size] = tag_id
+        self._cells[font_id, tag_id] = self._size
+        self._size += 1
+        self._num_fonts = max(self._num_fonts, font_id + 1)
+        self._num_tags = max(self._num_tags, tag_id + 1)
+
+    def fill(self, tag_fonts):
+        '''Sets the cells of tag_fonts, a list of pairs of a tag id and the list of ids of the
+        fonts with the tag, see FontCatModel.get_facet_cells. Only for an empty matrix.'''
+        fonts = [font_id for _, font_ids in tag_fonts for font_id in font_ids]
+        tags = [tag_id for tag_id, font_ids in tag_fonts for _ in font_ids]
+        size = len(fonts)
+        capacity = max(len(self._fonts), size)
+        self._fonts = np.zeros(capacity, dtype=np.intp)
+        self._tags = np.zeros(capacity, dtype=np.intp)
+        self._fonts[:size] = fonts
+        self._tags[:size] = tags
+        self._cells = dict(zip(zip(fonts, tags), range(size)))
+        self._size = size
+        self._num_fonts = max(fonts, default=-1) + 1
+        self._num_tags = max(tags, default=-1) + 1
+
+    def clear(self, font_id, tag_id):
+        index = self._cells.pop((font_id, tag_id), None)
+        if index is None:
+            return
+        # the last cell fills the gap, so the set cells stay at the start of the arrays
+        self._size -= 1
+        if index != self._size:
+            font_id, tag_id = int(self._fonts[self._size]), int(self._tags[self._size])
+            self._fonts[index] = font_id
+            self._tags[index] = tag_id
+            self._cells[font_id, tag_id] = index
+
+    def count(self, font_ids):
+        '''Returns array of the number of fonts of font_ids, a set of font ids, with each
+        tag id.'''
+        selected = np.zeros(self._num_fonts, dtype=bool)
+        font_ids = np.fromiter(font_ids, dtype=np.intp, count=len(font_ids))
+        selected[font_ids[font_ids < self._num_fonts]] = True
+        # weighing every cell is faster than picking out the cells of the fonts first
+        counts = np.bincount(self._tags[:self._size], weights=selected[self._fonts[:self._size]],
+                             minlength=self._num_tags)
+        return counts.astype(np.intp)
@@ -0,0 +1,143 @@
+import json
+import os
+import subprocess
+
+
+def list_font_files():
+    '''Returns dict of font family name to list of font files, as listed by fontconfig.
+    Returns an empty dict if fc-list can not be run.'''
+    try:
+        output = subprocess.run(['fc-list', '--format', '%{family}\t%{file}\n'],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    font_files = {}
+    for line in output.splitlines():
+        families, _, path = line.partition('\t')
+        for family in families.split(','):
+            font_files.setdefault(family, []).append(path)
+    return font_files
+
+
+# the generic families Pango lists along with the installed ones, which fc-list does not
+GENERIC_FAMILIES = ('Monospace', 'Sans', 'Serif', 'System-ui')
+
+
+def list_font_families():
+    '''Returns set of font family names, the first name of each font and the generic families
+    as Pango lists them, and set of the directories of their files, as listed by fontconfig.
+    Returns None, None if fc-list can not be run.'''
+    try:
+        output = subprocess.run(['fc-list', '--format', '%{family[0]}\t%{file}\n'],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    families, dirs = set(GENERIC_FAMILIES), set()
+    for line in output.splitlines():
+        family, _, path = line.partition('\t')
+        if family:
+            families.add(family)
+        dirs.add(os.path.dirname(path))
+    return families, dirs
+
+
+def list_system_fonts():
+    '''Returns sorted list of system font families, as list_font_families lists them, for the
+    window and the command line alike. Lists them with Pango if fc-list can not be run.'''
+    families, _ = list_font_families()
+    if families is None:
+        from fontspecimen import list_font_families as list_pango_families
+        return sorted(list_pango_families())
+    return sorted(families)
+
+
+def get_font_dirs():
+    '''Returns list of the font directories in fontconfig's default configuration that exist,
+    where new font directories are made.'''
+    home = os.path.expanduser('~')
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(home, '.local', 'share')
+    data_dirs = (os.environ.get('XDG_DATA_DIRS') or '/usr/local/share:/usr/share').split(':')
+    dirs = [os.path.join(data_dir, 'fonts') for data_dir in [data_home] + data_dirs]
+    dirs.append(os.path.join(home, '.fonts'))
+    return [font_dir for font_dir in dirs if os.path.isdir(font_dir)]
+
+
+def get_fontconfig_fingerprint():
+    '''Returns list of the paths and mtimes of fontconfig's configuration and caches and of
+    the font directories, one of which changes when fonts are installed, removed or configured.'''
+    home = os.path.expanduser('~')
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(home, '.cache')
+    config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(home, '.config')
+    paths = ['/etc/fonts', '/etc/fonts/conf.d', os.path.join(config_home, 'fontconfig'),
+             '/var/cache/fontconfig', os.path.join(cache_home, 'fontconfig')] + get_font_dirs()
+    fingerprint = []
+    for path in paths:
+        try:
+            fingerprint.append([path, os.stat(path).st_mtime_ns])
+        except OSError:
+            pass
+    return fingerprint
+
+
+def get_family_mtimes(font_files):
+    '''Returns dict of font family name to the newest mtime of its files.'''
+    mtimes = {}
+    stat_cache = {}
+    for family, paths in font_files.items():
+        newest = 0
+        for path in paths:
+            if path not in stat_cache:
+                try:
+                    stat_cache[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    stat_cache[path] = 0
+            newest = max(newest, stat_cache[path])
+        mtimes[family] = newest
+    return mtimes
+
+
+def get_cache_dir():
+    '''Returns the fontcat cache directory, found the way GLib does, without importing it.'''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'fontcat')
+
+
+def _read_cache_file(name):
+    try:
+        with open(os.path.join(get_cache_dir(), name)) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache_file(name, data):
+    cache_name = os.path.join(get_cache_dir(), name)
+    try:
+        os.makedirs(os.path.dirname(cache_name), exist_ok=True)
+        with open(cache_name + '.tmp', 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.replace(cache_name + '.tmp', cache_name)
+    except OSError:
+        pass
+
+
+def read_font_list_cache():
+    '''Returns list of font names last listed by the window, or None if there is none.'''
+    return _read_cache_file('fonts.json')
+
+
+def write_font_list_cache(font_list):
+    '''Saves font_list for read_font_list_cache, if it changed.'''
+    if read_font_list_cache() != font_list:
+        _write_cache_file('fonts.json', font_list)
+
+
+def read_session():
+    '''Returns dict of what the window saved when it was last closed, or None if there is
+    none, see FontWindow.save_session.'''
+    session = _read_cache_file('session.json')
+    return session if isinstance(session, dict) else None
+
+
+def write_session(session):
+    _write_cache_file('session.json', session)
@@ -0,0 +1,210 @@
+'''Facts about fonts read from their files: weight, width, italic, monospace, scripts and
+the Unicode characters they cover.
+
+Only the few sfnt tables needed are read (OS/2, head, post and cmap), so a file is read in
+a fraction of the time a full font parser takes. Files are read by a pool of processes, and
+the facts are kept in a cache by path and mtime, so only new or changed files are read again.'''
+import bisect
+import json
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from fontfiles import get_cache_dir, list_font_files
+
+
+# a font has a script if it covers all these characters
+SCRIPT_SAMPLES = {
+    'latin': 'AZaz',
+    'greek': 'ΑΩαω',
+    'cyrillic': 'АЯая',
+    'armenian': 'ԱՖ',
+    'hebrew': 'את',
+    'arabic': 'اي',
+    'devanagari': 'कह',
+    'bengali': 'কহ',
+    'thai': 'กฮ',
+    'georgian': 'აჰ',
+    'hangul': '가힣',
+    'hiragana': 'あん',
+    'katakana': 'アン',
+    'han': '一中国',
+    'ethiopic': 'ሀፐ',
+}
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _read_cmap(data):
+    '''Returns sorted list of [start, end] ranges of the characters a cmap table maps.'''
+    _, num_tables = struct.unpack_from('>HH', data)
+    subtables = {}
+    for i in range(num_tables):
+        platform_id, encoding_id, offset = struct.unpack_from('>HHL', data, 4 + 8 * i)
+        subtables.setdefault((platform_id, encoding_id), offset)
+    # full unicode subtables first, then those of the basic plane
+    for key in ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0), (3, 0)):
+        offset = subtables.get(key)
+        if offset is None:
+            continue
+        subtable_format, = struct.unpack_from('>H', data, offset)
+        if subtable_format == 12:
+            num_groups, = struct.unpack_from('>L', data, offset + 12)
+            return _merge_ranges(
+                struct.unpack_from('>LL', data, offset + 16 + 12 * i) for i in range(num_groups))
+        if subtable_format == 4:
+            seg_count = struct.unpack_from('>H', data, offset + 6)[0] // 2
+            ends = struct.unpack_from(f'>{seg_count}H', data, offset + 14)
+            starts = struct.unpack_from(f'>{seg_count}H', data, offset + 16 + 2 * seg_count)
+            return _merge_ranges((start, end) for start, end in zip(starts, ends)
+                                 if start != 0xFFFF)
+    return []
+
+
+def _read_face(font_file, offset):
+    '''Returns dict of facts of the sfnt face at offset in font_file.'''
+    font_file.seek(offset)
+    _, num_tables = struct.unpack('>LH', font_file.read(6))
+    font_file.seek(offset + 12)
+    directory = font_file.read(16 * num_tables)
+    tables = {}
+    for i in range(num_tables):
+        tag, _, table_offset, length = struct.unpack_from('>4sLLL', directory, 16 * i)
+        tables[tag] = (table_offset, length)
+
+    def read_table(tag):
+        if tag not in tables:
+            return None
+        table_offset, length = tables[tag]
+        font_file.seek(table_offset)
+        return font_file.read(length)
+
+    face = {'weight': 400, 'width': 5, 'italic': False, 'monospace': False}
+    os2 = read_table(b'OS/2')
+    if os2 is not None and len(os2) >= 64:
+        face['weight'], face['width'] = struct.unpack_from('>HH', os2, 4)
+        fs_selection, = struct.unpack_from('>H', os2, 62)
+        face['italic'] = bool(fs_selection & 0x201)
+        # panose proportion of latin text fonts
+        face['monospace'] = os2[32] == 2 and os2[35] == 9
+    head = read_table(b'head')
+    if head is not None and len(head) >= 46:
+        face['italic'] = face['italic'] or bool(struct.unpack_from('>H', head, 44)[0] & 2)
+    post = read_table(b'post')
+    if post is not None and len(post) >= 16:
+        face['monospace'] = face['monospace'] or struct.unpack_from('>L', post, 12)[0] != 0
+    cmap = read_table(b'cmap')
+    face['ranges'] = _read_cmap(cmap) if cmap is not None else []
+    facts = FamilyFacts([face])
+    face['scripts'] = [script for script, sample in SCRIPT_SAMPLES.items()
+                       if all(facts.covers(ord(c)) for c in sample)]
+    return face
+
+
+def read_font_faces(path):
+    '''Returns list of dicts of facts of the faces in the font file at path.
+    Files that are not TrueType or OpenType fonts or collections have no faces.'''
+    try:
+        with open(path, 'rb') as font_file:
+            tag = font_file.read(4)
+            if tag == b'ttcf':
+                _, num_fonts = struct.unpack('>LL', font_file.read(8))
+                offsets = struct.unpack(f'>{num_fonts}L', font_file.read(4 * num_fonts))
+            elif tag in (b'\x00\x01\x00\x00', b'OTTO', b'true'):
+                offsets = (0,)
+            else:
+                return []
+            return [_read_face(font_file, offset) for offset in offsets]
+    except (OSError, struct.error, IndexError):
+        return []
+
+
+class FamilyFacts:
+    '''Facts of a font family, from the facts of its faces.
+    A family has a weight, width or script if any of its faces has it.'''
+    __slots__ = ('weights', 'widths', 'italic', 'monospace', 'scripts', 'starts', 'ends')
+
+    def __init__(self, faces):
+        self.weights = frozenset(face['weight'] for face in faces)
+        self.widths = frozenset(face['width'] for face in faces)
+        self.italic = any(face['italic'] for face in faces)
+        self.monospace = any(face['monospace'] for face in faces)
+        self.scripts = frozenset(script for face in faces for script in face.get('scripts', ()))
+        ranges = _merge_ranges(tuple(r) for face in faces for r in face['ranges'])
+        self.starts = [start for start, _ in ranges]
+        self.ends = [end for _, end in ranges]
+
+    def covers(self, codepoint):
+        i = bisect.bisect_right(self.starts, codepoint) - 1
+        return i >= 0 and codepoint <= self.ends[i]
+
+
+class FontMetaIndex:
+    '''Cache of the facts of each font file by path and mtime, with the font files of each family.'''
+
+    def __init__(self, cache_file=None, workers=None):
+        self.cache_file = cache_file or os.path.join(get_cache_dir(), 'metadata.json')
+        self.workers = workers
+        try:
+            with open(self.cache_file) as cache:
+                data = json.load(cache)
+            self.families = data['families']
+            self.files = data['files']
+        except (OSError, ValueError, KeyError):
+            self.families = {}
+            self.files = {}
+
+    def update(self, font_files=None):
+        '''Reads the facts of new and changed font files, in a pool of processes.
+        font_files is a dict of family to list of paths, listed with fc-list by default.
+        Returns if anything changed.'''
+        if font_files is None:
+            font_files = list_font_files()
+        mtimes = {}
+        for paths in font_files.values():
+            for path in paths:
+                if path not in mtimes:
+                    try:
+                        mtimes[path] = os.stat(path).st_mtime_ns
+                    except OSError:
+                        pass
+        stale = [path for path, mtime in mtimes.items()
+                 if self.files.get(path, {}).get('mtime') != mtime]
+        removed = self.files.keys() - mtimes.keys()
+        changed = bool(stale or removed) or font_files != self.families
+        if stale:
+            # spawn, as the window's process has GTK loaded
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                for path, faces in zip(stale, executor.map(read_font_faces, stale, chunksize=32)):
+                    self.files[path] = {'mtime': mtimes[path], 'faces': faces}
+        for path in removed:
+            del self.files[path]
+        self.families = font_files
+        if changed:
+            self.save()
+        return changed
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file + '.tmp', 'w') as cache:
+            json.dump({'families': self.families, 'files': self.files}, cache)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
+
+    def get_family_facts(self):
+        '''Returns dict of family name to FamilyFacts, for families with readable font files.'''
+        family_facts = {}
+        for family, paths in self.families.items():
+            faces = [face for path in paths for face in self.files.get(path, {}).get('faces', ())]
+            if faces:
+                family_facts[family] = FamilyFacts(faces)
+        return family_facts
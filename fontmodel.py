@@ -1,150 +1,701 @@
-import json
+from collections import OrderedDict
+
+import fontstats
+from fontcomplete import TagCompletions
+from fontnames import NameIndex
+from fontquery import And, compile_query
+from fontstore import open_store, read_collections, write_collections
+
+
+_NO_TAGS = frozenset()
+
+
+class _FontRecord:
+    '''Font name, position in the list of all fonts (None until it is added) and tag ids as dict
+    keys in the order they were added (None until it is read from a lazy store).'''
+    __slots__ = ('name', 'index', 'tags')
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.index = None
+        self.tags = tags
+
+
+class _TagRecord:
+    '''Tag name, set of ids of listed fonts with the tag (None until it is read from a lazy store),
+    and count of all fonts with the tag (not kept for a lazy store, which counts tags itself).'''
+    __slots__ = ('name', 'fonts', 'count')
+
+    def __init__(self, name, fonts):
+        self.name = name
+        self.fonts = fonts
+        self.count = 0
+
+
+class _FontTags:
+    '''Tags and facts of a font by name, for matching query nodes against a font record.'''
+    __slots__ = ('model', 'tags', 'font_id')
+
+    def __init__(self, model):
+        self.model = model
+        self.tags = _NO_TAGS
+        self.font_id = None
+
+    def __contains__(self, tag):
+        if isinstance(tag, str):
+            return self.model._tag_ids.get(tag) in self.tags
+        # facts and names, whose fonts are cached by the model
+        return self.font_id in tag.evaluate(self.model)
 
 
 class FontCatModel:
 
-    def __init__(self, font_list, filename):
+    # number of query results kept by get_matching_fonts
+    QUERY_CACHE_SIZE = 64
+    # number of fonts matched by [like=font]
+    SIMILAR_FONTS = 50
+
+    def __init__(self, font_list, filename, backend=None, lock=False):
         '''
         font_list : list of font names, gotten from pango context
         filename : filename where tags of the fonts are stored
+        backend : 'json', 'snapshot' or 'sqlite', by default picked by the extension of filename,
+            see fontstore.open_store
+        lock : True to lock the tags against changes by other processes before they are read,
+            raising fontstore.StoreLockedError if another process has them, or 'wait' to wait
+            for it, see fontstore.JsonStore.lock
         '''
-        self.font_list = font_list
+        self.font_list = []
         self.filename = filename
 
         self.show_tags = True
+        self.sort_tags_by_count = False
         self.columns = -1
         self.view_size = 16
         self.view_text = "{font_name}"
+        self.virtual_grid = False
+        self.search_delay = 150
+        self.preview_cache = True
+        # dict of font name to facts read from its files, see fontmeta
+        self.font_facts = {}
+        # fontsimilar.SimilarityIndex, if there is one
+        self.similarity = None
+        # fonts of [fact] terms, which do not change with tags
+        self._fact_results = {}
+        # words of the names of listed fonts, for free text terms, made on the first one
+        self._names = None
+        self._name_ranks = {}
+        # tags by prefix and count, for completing tags, made on the first completion
+        self._completions = None
+        # fontfacets.TagFacets, for counting the tags of query results, if there is one, and the
+        # changes to it made while it is filled in the background, see get_facet_cells
+        self._facets = None
+        self._facet_changes = None
+        # saved queries by name, and the font ids of their results by query, kept up to date
+        # font by font as tags change, and made again after other changes
+        self._collections = {}
+        self._collection_results = {}
+        # called with the fonts whose tags changed, see add_listener
+        self._listeners = []
 
-        self.font_tags = {}
-        self.all_tags = {}
-        for font in self.font_list:
-            self.font_tags[font] = []
+        # fonts and tags are interned to ids, indexes into _fonts and _tags.
+        # Fonts in the tags file that are not listed yet have a record with no index.
+        self._font_ids = {}
+        self._fonts = []
+        self._tag_ids = {}
+        self._tags = []
+        self._free_tag_ids = []
+        self._listed = set()
+        self._unlisted = set()
+        # bumped on every tag change, so cached query results know when they are stale
+        self.generation = 0
+        self._query_results = OrderedDict()
 
+        self.store = None
         if filename is not None:
+            self.store = open_store(filename, backend)
+            if lock:
+                self.store.lock(wait=lock == 'wait')
+        # a lazy store is read a font or a tag at a time, as they are needed,
+        # and counts tags itself
+        self._lazy = self.store is not None and self.store.lazy
+        # set once the fonts of a tag are read from a lazy store, from then on fonts that are
+        # added or removed have their tags read too, to keep the fonts of read tags up to date
+        self._tag_fonts_read = False
+        self.add_fonts(font_list)
+        if self.store is not None:
             self.load_file()
+            self._collections = read_collections(filename)
+
+    def _intern_font(self, font_name):
+        font_id = self._font_ids.get(font_name)
+        if font_id is None:
+            font_id = self._font_ids[font_name] = len(self._fonts)
+            self._fonts.append(_FontRecord(font_name, None if self._lazy else _NO_TAGS))
+            self._unlisted.add(font_id)
+        return font_id
+
+    def _intern_tag(self, tag):
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            record = _TagRecord(tag, None if self._lazy else set())
+            if self._free_tag_ids:
+                tag_id = self._free_tag_ids.pop()
+                self._tags[tag_id] = record
+            else:
+                tag_id = len(self._tags)
+                self._tags.append(record)
+            self._tag_ids[tag] = tag_id
+        return tag_id
 
+    def _find_tag(self, tag):
+        '''Returns id of tag, or None if no font has it.'''
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None and self._lazy and self.store.has_tag(tag):
+            tag_id = self._intern_tag(tag)
+        return tag_id
+
+    def _get_font_tag_ids(self, font):
+        '''Returns tag ids of font record, reading them from a lazy store if needed.'''
+        if font.tags is None:
+            tags = self.store.get_font_tags(font.name)
+            font.tags = dict.fromkeys(self._intern_tag(tag) for tag in tags) if tags else _NO_TAGS
+        return font.tags
+
+    def _get_tag_font_ids(self, tag_id):
+        '''Returns set of listed font ids of tag, reading them from a lazy store if needed.'''
+        tag = self._tags[tag_id]
+        if tag.fonts is None:
+            font_ids = (self._font_ids.get(font_name)
+                        for font_name in self.store.get_tag_fonts(tag.name))
+            tag.fonts = {font_id for font_id in font_ids if font_id in self._listed}
+            self._tag_fonts_read = True
+            for font_id in tag.fonts:
+                self._set_facet(font_id, tag_id, True)
+        return tag.fonts
+
+    def _drop_tag(self, tag_id):
+        del self._tag_ids[self._tags[tag_id].name]
+        self._tags[tag_id] = None
+        self._free_tag_ids.append(tag_id)
+
+    @fontstats.timed('load_file')
     def load_file(self):
         '''Attempts to open file from filename specified in constructor.
-        Tries to get json, and creates lists from json.'''
-        with open(self.filename) as tags_file:
-            tags_list = json.load(tags_file)
-            for k, vals in tags_list.items():
-                self.all_tags[k] = len(vals)
-                for v in vals:
-                    if v in self.font_tags:
-                        self.font_tags[v].append(k)
+        Tries to get json, and creates lists from json, then replays the changes journaled since.
+        A lazy store is not read here.'''
+        if self._lazy:
+            self.generation += 1
+            return
+        tags_list, records = self.store.read()
+        for k, vals in tags_list.items():
+            tag_id = self._intern_tag(k)
+            tag = self._tags[tag_id]
+            for v in vals:
+                font = self._fonts[self._intern_font(v)]
+                if tag_id not in font.tags:
+                    self._link(font, tag_id, tag)
+
+        store, self.store = self.store, None
+        replay = {'add': self.add_tag, 'rmv': self.rmv_tag, 'rmv_all': self.remove_tag_from_all,
+                  'add_many': self.add_tag_to_fonts, 'rmv_many': self.rmv_tag_from_fonts}
+        for op, *args in records:
+            replay[op](*args)
+        self.store = store
+        self.generation += 1
+
+    # sets that are not read from a lazy store yet are left alone, the store has the change
+    def _link(self, font, tag_id, tag):
+        if font.tags is not None:
+            if not font.tags:
+                font.tags = {}
+            font.tags[tag_id] = None
+        if not self._lazy:
+            tag.count += 1
+        if font.index is not None and tag.fonts is not None:
+            tag.fonts.add(self._font_ids[font.name])
+            self._set_facet(self._font_ids[font.name], tag_id, True)
+
+    def _unlink(self, font, tag_id, tag):
+        if font.tags is not None:
+            font.tags.pop(tag_id, None)
+            if not font.tags:
+                font.tags = _NO_TAGS
+        if not self._lazy:
+            tag.count -= 1
+        if font.index is not None and tag.fonts is not None:
+            tag.fonts.discard(self._font_ids[font.name])
+            self._set_facet(self._font_ids[font.name], tag_id, False)
+
+    def _set_facet(self, font_id, tag_id, is_set):
+        if self._facets is not None:
+            (self._facets.set if is_set else self._facets.clear)(font_id, tag_id)
+        elif self._facet_changes is not None:
+            self._facet_changes.append((font_id, tag_id, is_set))
 
+    @fontstats.timed('save_file')
     def save_file(self):
         '''Attempts to write file in proper format to filename specified in constructor.'''
+        self.store.write(self.get_tags_list)
+
+    def compact(self):
+        '''Writes the tags file in the background if anything changed since it was written.
+        Changes are in the journal until then.'''
+        if self.store is not None and self.store.changes:
+            self.store.compact(self.get_tags_list)
+
+    def get_tags_list(self):
+        '''Returns dict of each tag to list of fonts with the tag, the format of the tags file.'''
+        if self._lazy:
+            return self.store.export_tags()
         tags_list = {}
-        for key in self.all_tags.keys():
-            tags_list[key] = []
-        for k, vals in self.font_tags.items():
-            for v in vals:
-                tags_list[v] += [k]
-        with open(self.filename, 'w') as tags_file:
-            json.dump(tags_list, tags_file)
+        for tag_id in self._tag_ids.values():
+            tags_list[tag_id] = sorted((self._fonts[font_id] for font_id in self._tags[tag_id].fonts),
+                                       key=lambda font: font.index)
+        for font_id in self._unlisted:
+            for tag_id in self._fonts[font_id].tags:
+                tags_list[tag_id].append(self._fonts[font_id])
+        return {self._tags[tag_id].name: [font.name for font in fonts]
+                for tag_id, fonts in tags_list.items()}
 
     def get_all_fonts(self):
-        '''Returns list of all fonts given in constructor.'''
+        '''Returns list of all fonts given in constructor or added since, and not removed.'''
         return self.font_list
 
+    def add_fonts(self, font_names):
+        '''Adds fonts to the list of all fonts, with their tags from the tags file.
+        Returns list of the fonts that were not there already.'''
+        added = []
+        for font_name in font_names:
+            font_id = self._intern_font(font_name)
+            font = self._fonts[font_id]
+            if font.index is not None:
+                continue
+            added.append(font_name)
+            font.index = len(self.font_list)
+            self.font_list.append(font_name)
+            self._listed.add(font_id)
+            self._unlisted.discard(font_id)
+            if self._names is not None:
+                self._names.add(font_id, font_name)
+            if font.tags is None and not self._tag_fonts_read:
+                continue
+            for tag_id in self._get_font_tag_ids(font):
+                if self._tags[tag_id].fonts is not None:
+                    self._tags[tag_id].fonts.add(font_id)
+                    self._set_facet(font_id, tag_id, True)
+        self._fact_results.clear()
+        self._name_ranks.clear()
+        self._collection_results.clear()
+        self.generation += 1
+        return added
+
+    def remove_fonts(self, font_names):
+        '''Removes fonts from the list of all fonts. They keep their tags, like fonts in the
+        tags file that are not installed. Returns list of the fonts that were there.'''
+        removed = []
+        for font_name in font_names:
+            font_id = self._font_ids.get(font_name)
+            if font_id is None or self._fonts[font_id].index is None:
+                continue
+            font = self._fonts[font_id]
+            removed.append(font_name)
+            font.index = None
+            self._listed.discard(font_id)
+            self._unlisted.add(font_id)
+            if self._names is not None:
+                self._names.remove(font_id)
+            if font.tags is None and not self._tag_fonts_read:
+                continue
+            for tag_id in self._get_font_tag_ids(font):
+                if self._tags[tag_id].fonts is not None:
+                    self._tags[tag_id].fonts.discard(font_id)
+                    self._set_facet(font_id, tag_id, False)
+        if not removed:
+            return removed
+        # in place, as the grid shows this list
+        self.font_list[:] = [font_name for font_name in self.font_list
+                             if self._fonts[self._font_ids[font_name]].index is not None]
+        for index, font_name in enumerate(self.font_list):
+            self._fonts[self._font_ids[font_name]].index = index
+        self._fact_results.clear()
+        self._name_ranks.clear()
+        self._collection_results.clear()
+        self.generation += 1
+        return removed
+
     def get_filtered_fonts(self, query):
-        '''Returns list of all fonts that satisfy query.'''
-        return list(filter(lambda fn: FontCatModel.filter_func(
-            self.get_font_name_w_tags(fn), query, False), self.font_list))
+        '''Returns list of all fonts that satisfy query, ranked fonts first, like those of
+        [like=font] by similarity or of free text by how well their names match, then in
+        list order.'''
+        font_ids = self._get_matching_ids(query)
+        ranks = compile_query(query).rank(self)
+        if ranks is None:
+            key = lambda font_id: self._fonts[font_id].index
+        else:
+            key = lambda font_id: (ranks.get(font_id, len(ranks)), self._fonts[font_id].index)
+        return [self._fonts[font_id].name for font_id in sorted(font_ids, key=key)]
+
+    def get_font_ranks(self, query):
+        '''Returns dict of ranked fonts of query to their rank, or None if query does not rank.'''
+        ranks = compile_query(query).rank(self)
+        if ranks is None:
+            return None
+        return {self._fonts[font_id].name: rank for font_id, rank in ranks.items()}
+
+    def get_font_index(self, font_name):
+        '''Returns position of font in the list of all fonts.'''
+        return self._fonts[self._font_ids[font_name]].index
+
+    @fontstats.timed('get_matching_fonts')
+    def get_matching_fonts(self, query):
+        '''Returns set of all fonts that satisfy query.
+        Results are cached until the next tag change, and a query that refines a cached
+        query only re-tests the fonts of that result. The set is shared, so do not modify it.'''
+        self._get_matching_ids(query)
+        cached = self._query_results[query]
+        if cached[2] is None:
+            cached[2] = {self._fonts[font_id].name for font_id in cached[1]}
+        return cached[2]
+
+    def _get_matching_ids(self, query):
+        cached = self._query_results.get(query)
+        if cached is not None and cached[0] == self.generation:
+            self._query_results.move_to_end(query)
+            fontstats.count('query_cache_hit')
+            return cached[1]
+
+        result = self._collection_results.get(query)
+        if result is not None:
+            fontstats.count('query_collection')
+        else:
+            node = compile_query(query)
+            result = self._narrow(node)
+            if result is None:
+                fontstats.count('query_evaluated')
+                result = node.evaluate(self)
+            else:
+                fontstats.count('query_narrowed')
+            if query in self._collections.values():
+                # a copy, results may be the sets of tags, kept up to date by _update_collections
+                result = self._collection_results[query] = set(result)
+        # generation, font ids, and font names once asked for
+        self._query_results[query] = [self.generation, result, None]
+        self._query_results.move_to_end(query)
+        if len(self._query_results) > self.QUERY_CACHE_SIZE:
+            self._query_results.popitem(last=False)
+        return result
+
+    def _narrow(self, node):
+        '''Returns result of node by testing the smallest current cached result of a query
+        that node strictly refines, or None if there is no such query.'''
+        terms = node.conjuncts()
+        base_terms, base_ids = None, None
+        for query, (generation, font_ids, _) in self._query_results.items():
+            if generation != self.generation:
+                continue
+            query_terms = compile_query(query).conjuncts()
+            if query_terms < terms and (base_ids is None or len(font_ids) < len(base_ids)):
+                base_terms, base_ids = query_terms, font_ids
+        if base_ids is None:
+            return None
+        extra = And(terms - base_terms)
+        if self._lazy:
+            # testing font by font would read the tags of each font from the store
+            return base_ids & extra.evaluate(self)
+        font_tags = _FontTags(self)
+        result = set()
+        for font_id in base_ids:
+            font_tags.tags = self._fonts[font_id].tags
+            font_tags.font_id = font_id
+            if extra.matches(font_tags):
+                result.add(font_id)
+        return result
+
+    def get_font_set(self):
+        '''Returns set of ids of all listed fonts.'''
+        return self._listed
+
+    def get_tag_fonts(self, tag):
+        '''Returns set of ids of listed fonts that have tag.'''
+        tag_id = self._find_tag(tag)
+        return _NO_TAGS if tag_id is None else self._get_tag_font_ids(tag_id)
+
+    def get_fact_fonts(self, fact):
+        '''Returns set of ids of listed fonts whose facts satisfy fact, a query node.'''
+        font_ids = self._fact_results.get(fact)
+        if font_ids is not None:
+            return font_ids
+        if fact.name == 'like':
+            font_ids = set(self.get_fact_ranks(fact))
+        else:
+            font_ids = set()
+            for font_name, facts in self.font_facts.items():
+                font_id = self._font_ids.get(font_name)
+                if font_id in self._listed and fact.test(facts):
+                    font_ids.add(font_id)
+        self._fact_results[fact] = font_ids
+        return font_ids
+
+    def get_fact_ranks(self, fact):
+        '''Returns dict of ids of listed fonts most like the font of a [like=font] fact to their
+        rank, with the font itself first.'''
+        if self.similarity is None:
+            return {}
+        font_ids = (self._font_ids.get(font_name) for font_name in
+                    [fact.value] + self.similarity.similar(fact.value, self.SIMILAR_FONTS))
+        listed = [font_id for font_id in font_ids if font_id in self._listed]
+        return {font_id: rank for rank, font_id in enumerate(listed)}
+
+    def get_name_fonts(self, name):
+        '''Returns set of ids of listed fonts whose names match name, a query node.'''
+        font_ids = self._fact_results.get(name)
+        if font_ids is None:
+            font_ids = self._fact_results[name] = set(self.get_name_ranks(name))
+        return font_ids
+
+    def get_name_ranks(self, name):
+        '''Returns dict of ids of listed fonts whose names match name, a query node, to their
+        rank, best match first and ties in list order.'''
+        ranks = self._name_ranks.get(name)
+        if ranks is None:
+            if self._names is None:
+                self._names = NameIndex()
+                for font_id in self._listed:
+                    self._names.add(font_id, self._fonts[font_id].name)
+            scores = self._names.search(name.text)
+            order = sorted(scores, key=lambda font_id: (-scores[font_id],
+                                                         self._fonts[font_id].index))
+            ranks = self._name_ranks[name] = {font_id: rank for rank, font_id in enumerate(order)}
+        return ranks
+
+    def set_font_facts(self, font_facts):
+        '''Sets the facts of fonts, a dict of font name to fontmeta.FamilyFacts.'''
+        self.font_facts = font_facts
+        self.clear_caches()
+
+    def set_similarity(self, similarity):
+        '''Sets the fontsimilar.SimilarityIndex used by [like=font] terms.'''
+        self.similarity = similarity
+        self.clear_caches()
+
+    def clear_caches(self, name_index=False):
+        '''Drops all cached query results, so queries are evaluated again. With name_index,
+        the index of font names is dropped too, to be made again by the next free text query.'''
+        self._query_results.clear()
+        self._fact_results.clear()
+        self._name_ranks.clear()
+        self._collection_results.clear()
+        if name_index:
+            self._names = None
+        elif self._names is not None:
+            self._names.clear_cache()
+        self.generation += 1
+
+    def get_facet_cells(self):
+        '''Returns list of pairs of a tag id and the list of ids of the listed fonts with the tag,
+        for filling a fontfacets.TagFacets in the background. Tags not read from a lazy store
+        yet are left out, they are added as they are read. Changes from now on are kept until
+        the facets are set, see set_facets.'''
+        self._facet_changes = []
+        return [(tag_id, list(tag.fonts)) for tag_id, tag in enumerate(self._tags)
+                if tag is not None and tag.fonts is not None]
+
+    def set_facets(self, facets):
+        '''Sets the fontfacets.TagFacets used by get_tag_counts, filled with the cells of
+        get_facet_cells. The changes made since are applied to it, and it is kept up to date
+        with each tag change from then on.'''
+        for font_id, tag_id, is_set in self._facet_changes or ():
+            (facets.set if is_set else facets.clear)(font_id, tag_id)
+        self._facet_changes = None
+        self._facets = facets
+
+    @fontstats.timed('get_tag_counts')
+    def get_tag_counts(self, query):
+        '''Returns dict of each tag to the number of fonts satisfying query that have it, or None
+        if there are no facets to count them with. Tags not read from a lazy store yet are not
+        counted, and left out.'''
+        if self._facets is None:
+            return None
+        counts = self._facets.count(self._get_matching_ids(query)).tolist()
+        return {tag.name: counts[tag_id] if tag_id < len(counts) else 0
+                for tag_id, tag in enumerate(self._tags) if tag is not None and tag.fonts is not None}
 
     def get_all_tags(self):
         '''Returns list of all current tags.'''
-        return self.all_tags.keys()
+        if self._lazy:
+            return self.store.get_tags()
+        return self._tag_ids.keys()
+
+    def get_tag_count(self, tag):
+        '''Returns number of fonts that have tag.'''
+        if self._lazy:
+            return self.store.count(tag)
+        tag_id = self._tag_ids.get(tag)
+        return 0 if tag_id is None else self._tags[tag_id].count
+
+    def get_all_tag_counts(self):
+        '''Returns dict of each current tag to the number of fonts that have it.'''
+        if self._lazy:
+            return self.store.counts()
+        return {tag: self._tags[tag_id].count for tag, tag_id in self._tag_ids.items()}
 
     def remove_tag_from_all(self, tag):
         '''Removes tag from list of current tags and from all fonts.'''
-        del self.all_tags[tag]
-        for v in self.font_tags.values():
-            if tag in v:
-                v.remove(tag)
+        tag_id = self._find_tag(tag)
+        if tag_id is None:
+            return
+        tag_record = self._tags[tag_id]
+        if self._lazy:
+            font_ids = [self._font_ids[font_name] for font_name in self.store.get_tag_fonts(tag)
+                        if font_name in self._font_ids]
+        else:
+            font_ids = list(tag_record.fonts) + [font_id for font_id in self._unlisted
+                                                 if tag_id in self._fonts[font_id].tags]
+        for font_id in font_ids:
+            self._unlink(self._fonts[font_id], tag_id, tag_record)
+        self._drop_tag(tag_id)
+        self.generation += 1
+        if self.store is not None:
+            self.store.append('rmv_all', tag)
+        self._update_completions(tag)
+        self._notify([self._fonts[font_id].name for font_id in font_ids], True)
+
+    @fontstats.timed('complete_tag')
+    def complete_tag(self, prefix, limit=10, exclude=()):
+        '''Returns up to limit tags starting with prefix, ignoring case, most used first,
+        leaving out the tags in exclude.'''
+        if self._completions is None:
+            self._completions = TagCompletions(self.get_all_tag_counts().items())
+        return self._completions.complete(prefix, limit, exclude)
 
-    def get_font_name_w_tags(self, font_name):
-        '''Returns string of font name and tags, used for filtering.'''
-        return f'{font_name} : {"{" + "},{".join(self.get_font_tags(font_name)) + "}"}'
+    def _update_completions(self, tag):
+        if self._completions is not None:
+            self._completions.set_count(tag, self.get_tag_count(tag))
 
     def get_font_tags(self, font_name):
-        '''Returns list of tags that a font has'''
-        return self.font_tags[font_name]
+        '''Returns list of tags that a font has, in the order they were added'''
+        font = self._fonts[self._font_ids[font_name]]
+        return [self._tags[tag_id].name for tag_id in self._get_font_tag_ids(font)]
 
     def add_tag(self, font_name, text):
         '''Attempts to add tag to list of tags for font_name.
+        Fonts not in the list of all fonts keep the tag until they are added.
         Returns if parent window tag flowbox needs to be reloaded.'''
-        if text not in self.font_tags[font_name]:
-            self.font_tags[font_name].append(text)
-            if text in self.all_tags:
-                self.all_tags[text] += 1
-            else:
-                self.all_tags[text] = 1
-                return True
-        return False
+        return self.add_tag_to_fonts([font_name], text)
 
     def rmv_tag(self, font_name, tag):
         '''Attemps to remove tag from list of tags of font_name.
         Returns if parent window tag flowbox needs to be reloaded.'''
-        if tag in self.font_tags[font_name]:
-            self.font_tags[font_name].remove(tag)
-            self.all_tags[tag] -= 1
-            if self.all_tags[tag] == 0:
-                del self.all_tags[tag]
-                return True
-        return False
-
-    # TODO: should this be in this class?
-    def filter_func(item, search_text, fb_filter=True):
-        '''Function that parses filter.'''
-        if fb_filter:
-            item = item.get_name()
-
-        if search_text == '{{All Fonts}}':
-            return True
-        try:
-            stack = []
-            op_dict = {
-                "!": lambda x, y: not y,
-                "|": lambda x, y: x or y,
-                "&": lambda x, y: x and y,
-            }
-
-            def eval_stack():
-                right = stack.pop()
-                op = stack.pop()
-                if op == '(':
-                    stack.append(right)
-                    return False
-                left = None if op == '!' else stack.pop()
-                stack.append(op_dict[op](left, right))
-                return True
-            i, start = 0, -1
-            while i < len(search_text):
-                if search_text[i] == '}':
-                    stack.append(search_text[start:i+1] in item)
-                    start = -1
-                elif start == -1:
-                    if search_text[i] == '{':
-                        start = i
-                    elif search_text[i] == ')':
-                        cont_eval = True
-                        while cont_eval:
-                            cont_eval = eval_stack()
-                    elif search_text[i] == '(':
-                        stack.append('(')
-                    elif search_text[i] == '!' or search_text[i:i+3].lower() == 'not':
-                        stack.append('!')
-                    elif search_text[i] == '|' or search_text[i:i+2].lower() == 'or':
-                        stack.append('|')
-                    elif search_text[i] == '&' or search_text[i:i+3].lower() == 'and':
-                        stack.append('&')
-                i += 1
-            while len(stack) > 1:
-                eval_stack()
-            return stack[0]
-        except:
+        return self.rmv_tag_from_fonts([font_name], tag)
+
+    def add_tag_to_fonts(self, font_names, text):
+        '''Adds tag to each of font_names that does not have it, as one change.
+        Returns if the list of all tags changed.'''
+        is_new = self._find_tag(text) is None
+        tag_id = self._intern_tag(text)
+        tag_record = self._tags[tag_id]
+        added = []
+        for font_name in font_names:
+            font = self._fonts[self._intern_font(font_name)]
+            if tag_id not in self._get_font_tag_ids(font):
+                self._link(font, tag_id, tag_record)
+                added.append(font_name)
+        if not added:
+            if is_new:
+                self._drop_tag(tag_id)
             return False
+        self.generation += 1
+        if self.store is not None:
+            self.store.append('add_many', added, text)
+        self._update_completions(text)
+        self._notify(added, is_new)
+        return is_new
+
+    def rmv_tag_from_fonts(self, font_names, tag):
+        '''Removes tag from each of font_names that has it, as one change.
+        Returns if the list of all tags changed, which it does once no font has the tag.'''
+        tag_id = self._find_tag(tag)
+        if tag_id is None:
+            return False
+        tag_record = self._tags[tag_id]
+        removed = []
+        for font_name in font_names:
+            font_id = self._font_ids.get(font_name)
+            if font_id is None and self._lazy:
+                # not read from the store yet, which may have it with the tag
+                font_id = self._intern_font(font_name)
+            if font_id is not None and tag_id in self._get_font_tag_ids(self._fonts[font_id]):
+                self._unlink(self._fonts[font_id], tag_id, tag_record)
+                removed.append(font_name)
+        if not removed:
+            return False
+        self.generation += 1
+        if self.store is not None:
+            self.store.append('rmv_many', removed, tag)
+        dropped = self.get_tag_count(tag) == 0
+        if dropped:
+            self._drop_tag(tag_id)
+        self._update_completions(tag)
+        self._notify(removed, dropped)
+        return dropped
+
+    def get_collections(self):
+        '''Returns dict of the name of each smart collection to its query.'''
+        return self._collections
+
+    def add_collection(self, name, query):
+        '''Saves query as smart collection name, replacing any collection of that name.
+        Its result is kept up to date as tags change, so showing it takes no search.'''
+        old_query = self._collections.get(name)
+        self._collections[name] = query
+        self._drop_collection_result(old_query)
+        if query not in self._collection_results:
+            self._collection_results[query] = set(self._get_matching_ids(query))
+        self._save_collections()
+
+    def remove_collection(self, name):
+        '''Removes smart collection name, if there is one.'''
+        self._drop_collection_result(self._collections.pop(name, None))
+        self._save_collections()
+
+    def _drop_collection_result(self, query):
+        if query is not None and query not in self._collections.values():
+            self._collection_results.pop(query, None)
+
+    def _save_collections(self):
+        if self.filename is not None:
+            write_collections(self.filename, self._collections)
+
+    def _update_collections(self, font_names):
+        '''Tests font_names, whose tags changed, against the queries of the smart collections,
+        adding them to or removing them from their results.'''
+        font_tags = _FontTags(self)
+        for query, font_ids in self._collection_results.items():
+            node = compile_query(query)
+            for font_name in font_names:
+                font_id = self._font_ids[font_name]
+                if font_id not in self._listed:
+                    continue
+                font_tags.tags = self._get_font_tag_ids(self._fonts[font_id])
+                font_tags.font_id = font_id
+                if node.matches(font_tags):
+                    font_ids.add(font_id)
+                else:
+                    font_ids.discard(font_id)
+
+    def add_listener(self, listener):
+        '''Calls listener(font_names, tags_changed) after tags change, with the set of fonts
+        whose tags changed and if the list of all tags changed. A change to many fonts, see
+        add_tag_to_fonts, is reported once.'''
+        self._listeners.append(listener)
+
+    def _notify(self, font_names, tags_changed):
+        if self._collection_results and font_names:
+            self._update_collections(font_names)
+        if not (font_names or tags_changed):
+            return
+        changed_fonts = set(font_names)
+        for listener in self._listeners:
+            listener(changed_fonts, tags_changed)
+
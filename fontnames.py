@@ -0,0 +1,184 @@
+import math
+import re
+
+
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    '''Returns text in lower case, with runs of anything but letters and digits as one space.'''
+    return _SEPARATORS.sub(' ', text.lower()).strip()
+
+
+def ngrams(normalized, n=2):
+    '''Returns set of n-grams of normalized text, padded so word starts and ends count.'''
+    padded = f' {normalized} '
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def is_one_edit(word, other):
+    '''Returns if other is word with one letter changed, added or removed, or two letters next
+    to each other swapped.'''
+    if abs(len(word) - len(other)) > 1 or word == other:
+        return False
+    i = 0
+    while i < len(word) and i < len(other) and word[i] == other[i]:
+        i += 1
+    if len(word) > len(other):
+        return word[i + 1:] == other[i:]
+    if len(word) < len(other):
+        return word[i:] == other[i + 1:]
+    return (word[i + 1:] == other[i + 1:] or
+            (i + 1 < len(word) and word[i] == other[i + 1] and word[i + 1] == other[i] and
+             word[i + 2:] == other[i + 2:]))
+
+
+class NameIndex:
+    '''Index of the words of font names, for finding fonts by their name as it is typed,
+    typos and all.
+
+    Each word of a query matches the words of names that start with it, and, through a bigram
+    index of the words, the words that have at least MIN_SHARED of its bigrams, or that are one
+    edit away from it, such as two letters swapped, which can leave few bigrams in common.
+    A font matches if each word of the query matches one of its words.
+    Names share most of their words, so words are matched in a small index, and the cost of
+    a lookup is mostly that of the fonts it finds.'''
+
+    MIN_SHARED = 0.6
+    # shorter words only match by their bigrams, one edit turns them into too many other words
+    MIN_EDIT_LENGTH = 3
+    # words are listed by their first letters up to this many, for matching by prefix
+    PREFIX_LENGTH = 3
+    WORD_CACHE_SIZE = 256
+
+    def __init__(self):
+        self._word_ids = {}
+        self._words = []
+        # set of font ids of each word, by word id
+        self._word_fonts = []
+        # list of word ids by bigram and by prefix
+        self._bigrams = {}
+        self._prefixes = {}
+        # normalized name and tuple of word ids by font id
+        self._names = {}
+        self._font_words = {}
+        # matches of the words of recent queries, as the words before the one being typed
+        # are looked up again on each key
+        self._word_matches = {}
+
+    def add(self, font_id, font_name):
+        name = normalize(font_name)
+        self._names[font_id] = name
+        word_ids = []
+        for word in name.split():
+            word_id = self._word_ids.get(word)
+            if word_id is None:
+                word_id = self._add_word(word)
+            if word_id not in word_ids:
+                word_ids.append(word_id)
+                self._word_fonts[word_id].add(font_id)
+        self._font_words[font_id] = tuple(word_ids)
+
+    def remove(self, font_id):
+        for word_id in self._font_words.pop(font_id):
+            self._word_fonts[word_id].discard(font_id)
+        del self._names[font_id]
+
+    def _add_word(self, word):
+        word_id = self._word_ids[word] = len(self._words)
+        self._words.append(word)
+        self._word_fonts.append(set())
+        for bigram in ngrams(word):
+            self._bigrams.setdefault(bigram, []).append(word_id)
+        for length in range(1, min(len(word), self.PREFIX_LENGTH) + 1):
+            self._prefixes.setdefault(word[:length], []).append(word_id)
+        if self._word_matches:
+            # the new word may match them
+            self._word_matches.clear()
+        return word_id
+
+    def clear_cache(self):
+        '''Drops the matches of the words of recent queries.'''
+        self._word_matches.clear()
+
+    def match_word(self, query_word):
+        '''Returns dict of ids of words like query_word, a normalized word, to their
+        similarity, 1 for query_word itself.'''
+        matches = self._word_matches.get(query_word)
+        if matches is not None:
+            return matches
+        matches = {}
+        # numbers that differ are different fonts, not typos
+        if not query_word.isdigit():
+            query_bigrams = ngrams(query_word)
+            needed = math.ceil(self.MIN_SHARED * len(query_bigrams))
+            # one edit leaves all but at most 3 bigrams, when it swaps two letters
+            edit_needed = needed
+            if len(query_word) >= self.MIN_EDIT_LENGTH:
+                edit_needed = min(needed, max(1, len(query_bigrams) - 3))
+            # a word with edit_needed bigrams in common has one of the rarest few of them
+            postings = sorted((self._bigrams.get(bigram, ()) for bigram in query_bigrams),
+                              key=len)
+            candidates = set()
+            for posting in postings[:len(query_bigrams) - edit_needed + 1]:
+                candidates.update(posting)
+            for word_id in candidates:
+                word = self._words[word_id]
+                padded = f' {word} '
+                shared = 0
+                for bigram in query_bigrams:
+                    if bigram in padded:
+                        shared += 1
+                if shared >= needed:
+                    matches[word_id] = 2 * shared / (len(query_bigrams) + len(padded) - 1)
+                elif shared >= edit_needed and is_one_edit(query_word, word):
+                    matches[word_id] = 1 - 1 / max(len(query_word), len(word))
+        for word_id in self._prefixes.get(query_word[:self.PREFIX_LENGTH], ()):
+            word = self._words[word_id]
+            if word.startswith(query_word):
+                similarity = 0.5 + 0.5 * len(query_word) / len(word)
+                if similarity > matches.get(word_id, 0):
+                    matches[word_id] = similarity
+        if len(self._word_matches) >= self.WORD_CACHE_SIZE:
+            self._word_matches.clear()
+        self._word_matches[query_word] = matches
+        return matches
+
+    def search(self, text):
+        '''Returns dict of ids of fonts matching text to their score, higher is better.
+        Fonts are scored by how well their words match the words of text, plus a bonus for
+        names containing text as is, and another if they start with it.'''
+        query = normalize(text)
+        word_matches = [self.match_word(word) for word in dict.fromkeys(query.split())]
+        if not word_matches or not all(word_matches):
+            return {}
+        # fonts of the query word with the fewest, tested for the other words
+        sizes = [sum(len(self._word_fonts[word_id]) for word_id in matches)
+                 for matches in word_matches]
+        candidates = set()
+        for word_id in word_matches[sizes.index(min(sizes))]:
+            candidates.update(self._word_fonts[word_id])
+
+        scores = {}
+        for font_id in candidates:
+            font_words = self._font_words[font_id]
+            total = 0
+            for matches in word_matches:
+                best = 0
+                for word_id in font_words:
+                    similarity = matches.get(word_id, 0)
+                    if similarity > best:
+                        best = similarity
+                if not best:
+                    break
+                total += best
+            else:
+                # of names matching as well, shorter ones first
+                score = (total + 0.1 / len(font_words)) / len(word_matches)
+                name = self._names[font_id]
+                if name.startswith(query):
+                    score += 2
+                elif query in name:
+                    score += 1
+                scores[font_id] = score
+        return scores
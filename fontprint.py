@@ -1,7 +1,9 @@
 import gi
 gi.require_version('Gtk', '3.0')
-gi.require_version('PangoCairo', '1.0')
-from gi.repository import Gtk, Pango, PangoCairo
+from gi.repository import Gtk
+
+import fontstats
+from fontspecimen import SpecimenLayout
 
 
 class FontPrint:
@@ -11,64 +13,23 @@ class FontPrint:
         self.parent_window = parent_window
         self.font_model = font_model
         self.font_list = font_model.get_filtered_fonts(last_query)
-        self.columns = self.font_model.columns
-        self.arial_size = arial_size
-        self.margin_btwn = margin_btwn
+        self.specimen = SpecimenLayout(self.font_list, font_model.columns, font_model.view_size,
+                                       font_model.view_text, margin_btwn, arial_size)
 
         self.operation.connect('begin-print', self.begin_print, None)
         self.operation.connect('draw-page', self.draw_page, None)
 
+    @fontstats.timed('print_paginate')
     def begin_print(self, operation, context, print_data):
+        '''Measures the fonts and splits them into pages, once for all draw-page calls.'''
         operation.set_unit(Gtk.Unit.MM)
-        def ciel_div(x, y): return x//y if x % y == 0 else x//y+1
-        height = context.get_height()
-        self.rows_per_page = int((height + self.margin_btwn) /
-                                 (self.font_model.view_size + self.arial_size + 3 + self.margin_btwn))
-        needed_rows = ciel_div(len(self.font_list), self.columns)
-        num_pages = max(1, ciel_div(needed_rows, self.rows_per_page))
+        num_pages = self.specimen.paginate(context.get_cairo_context(),
+                                           context.get_width(), context.get_height())
         operation.set_n_pages(num_pages)
 
+    @fontstats.timed('print_draw_page')
     def draw_page(self, operation, context, page_num, print_data):
-        width = context.get_width()
-        cr = context.get_cairo_context()
-        box_width = (width - ((self.columns-1) *
-                     self.margin_btwn)) / self.columns
-
-        fonts_per_page = self.columns*self.rows_per_page
-        start = page_num*fonts_per_page
-        fonts = self.font_list[start:start+fonts_per_page]
-        for i, font in enumerate(fonts):
-            cr.set_source_rgb(0, 0, 0)
-            x = (i % self.columns) * (box_width + self.margin_btwn)
-            y = (i // self.columns) * (self.font_model.view_size +
-                                       self.arial_size + 3 + self.margin_btwn)
-            name_layout = PangoCairo.create_layout(cr)
-            name_layout.set_markup(
-                f"<span font=\"sans serif {self.arial_size}px\">{font}</span>")
-            name_layout.set_ellipsize(Pango.EllipsizeMode.END)
-            name_layout.set_width(box_width * Pango.SCALE)
-            cr.move_to(x, y)
-            PangoCairo.show_layout(cr, name_layout)
-            y += self.arial_size + 3
-            new_layout = PangoCairo.create_layout(cr)
-            disp_text = font if self.font_model.view_text == "{font_name}" else self.font_model.view_text
-            new_layout.set_markup(
-                f"<span font=\"{font} {self.font_model.view_size}px\">{disp_text}</span>")
-            new_layout.set_ellipsize(Pango.EllipsizeMode.END)
-            new_layout.set_width(box_width * Pango.SCALE)
-            new_layout.set_height(self.font_model.view_size * Pango.SCALE)
-            w, h = new_layout.get_pixel_size()
-            #cr.rectangle(x, y, box_width, self.font_model.view_size)
-            #cr.set_source_rgb(0, (fonts_per_page-i)/fonts_per_page, (fonts_per_page-i)/fonts_per_page)
-            # cr.fill()
-            y -= (h - self.font_model.view_size)/2  # fixes vertical alignment
-            # NOTE: may make text overlap on the top, but otherwise it does on the bottom, so...
-            #cr.rectangle(x, y, w, h)
-            #cr.set_source_rgba(i/fonts_per_page, i/fonts_per_page, 0, 0.5)
-            # cr.fill()
-            cr.set_source_rgb(0, 0, 0)
-            cr.move_to(x, y)
-            PangoCairo.show_layout(cr, new_layout)
+        self.specimen.draw_page(context.get_cairo_context(), page_num)
 
     def run(self):
         self.operation.set_embed_page_setup(True)
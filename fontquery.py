@@ -0,0 +1,405 @@
+import functools
+import operator
+
+
+ALL_FONTS = '{{All Fonts}}'
+
+
+class QueryError(ValueError):
+    '''Raised when a filter query can not be parsed.'''
+
+
+class Node:
+    '''Base of query nodes. Nodes with the same structure compare equal.'''
+    __slots__ = ()
+
+    def key(self):
+        return (type(self).__name__,)
+
+    def conjuncts(self):
+        '''Returns set of nodes that all have to match for this node to match.'''
+        return frozenset((self,))
+
+    def rank(self, index):
+        '''Returns dict of font to rank, lowest first, if this node orders its fonts, else None.'''
+        return None
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+class MatchAll(Node):
+    __slots__ = ()
+
+    def matches(self, tags):
+        return True
+
+    def evaluate(self, index):
+        return index.get_font_set()
+
+
+class MatchNone(Node):
+    __slots__ = ()
+
+    def matches(self, tags):
+        return False
+
+    def evaluate(self, index):
+        return set()
+
+
+class Tag(Node):
+    __slots__ = ('tag',)
+
+    def __init__(self, tag):
+        self.tag = tag
+
+    def key(self):
+        return ('Tag', self.tag)
+
+    def matches(self, tags):
+        return self.tag in tags
+
+    def evaluate(self, index):
+        return index.get_tag_fonts(self.tag)
+
+
+class Fact(Node):
+    '''Test of a fact read from the font files, like [weight>=700] or [script=greek],
+    or [like=font], the fonts that look most like font.'''
+    __slots__ = ('name', 'op', 'value')
+
+    def __init__(self, name, op=None, value=None):
+        self.name = name
+        self.op = op
+        self.value = value
+
+    def key(self):
+        return ('Fact', self.name, self.op, self.value)
+
+    def matches(self, tags):
+        # tags hold facts when they can, so plain lists of tags match no facts
+        return self in tags
+
+    def evaluate(self, index):
+        return index.get_fact_fonts(self)
+
+    def rank(self, index):
+        if self.name == 'like':
+            return index.get_fact_ranks(self)
+        return None
+
+    def test(self, facts):
+        '''Returns if family facts, see fontmeta.FamilyFacts, satisfy this test.'''
+        if facts is None:
+            return False
+        if self.name == 'italic':
+            return facts.italic
+        if self.name == 'monospace':
+            return facts.monospace
+        if self.name == 'script':
+            return self.value in facts.scripts
+        if self.name == 'covers':
+            return all(facts.covers(codepoint) for codepoint in self.value)
+        compare = _COMPARISONS[self.op]
+        values = facts.weights if self.name == 'weight' else facts.widths
+        return any(compare(value, self.value) for value in values)
+
+
+_COMPARISONS = {'>=': operator.ge, '<=': operator.le, '!=': operator.ne,
+                '=': operator.eq, '<': operator.lt, '>': operator.gt}
+_FACT_NAMES = {
+    'weight': {'thin': 100, 'extralight': 200, 'light': 300, 'regular': 400, 'normal': 400,
+               'medium': 500, 'semibold': 600, 'bold': 700, 'extrabold': 800, 'black': 900},
+    'width': {'ultracondensed': 1, 'extracondensed': 2, 'condensed': 3, 'semicondensed': 4,
+              'normal': 5, 'semiexpanded': 6, 'expanded': 7, 'extraexpanded': 8,
+              'ultraexpanded': 9},
+}
+
+
+def parse_fact(text):
+    '''Parses the text between [ and ] of a fact term. Raises QueryError if it is not valid.'''
+    name, op, value = text, None, None
+    for comparison in _COMPARISONS:
+        name, found, rest = text.partition(comparison)
+        if found:
+            op, value = found, rest.strip()
+            break
+    else:
+        name = text
+    name = name.strip().lower()
+    if name == 'mono':
+        name = 'monospace'
+    if name in ('italic', 'monospace'):
+        if op is None:
+            return Fact(name)
+    elif name in _FACT_NAMES:
+        if op is not None and value:
+            value = value.lower()
+            if value.isdigit():
+                return Fact(name, op, int(value))
+            if value in _FACT_NAMES[name]:
+                return Fact(name, op, _FACT_NAMES[name][value])
+    elif name == 'script':
+        if op == '=' and value:
+            return Fact(name, op, value.lower())
+    elif name == 'like':
+        if op == '=' and value:
+            return Fact(name, op, value)
+    elif name == 'covers':
+        if op == '=' and value:
+            try:
+                if value.upper().startswith('U+'):
+                    codepoints = tuple(int(code.strip()[2:], 16) for code in value.split(','))
+                else:
+                    codepoints = tuple(ord(c) for c in value)
+                return Fact(name, op, codepoints)
+            except ValueError:
+                pass
+    raise QueryError(f"invalid fact [{text}]")
+
+
+class Name(Node):
+    '''Free text matched against font names, allowing for typos.
+    Orders its fonts by how well their names match.'''
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def key(self):
+        return ('Name', self.text.lower())
+
+    def matches(self, tags):
+        # like facts, names are only known to tags that can hold them
+        return self in tags
+
+    def evaluate(self, index):
+        return index.get_name_fonts(self)
+
+    def rank(self, index):
+        return index.get_name_ranks(self)
+
+
+class Not(Node):
+    __slots__ = ('child',)
+
+    def __init__(self, child):
+        self.child = child
+
+    def key(self):
+        return ('Not', self.child.key())
+
+    def matches(self, tags):
+        return not self.child.matches(tags)
+
+    def evaluate(self, index):
+        return index.get_font_set() - self.child.evaluate(index)
+
+
+class And(Node):
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = tuple(_flatten(And, children))
+
+    def key(self):
+        return ('And', frozenset(child.key() for child in self.children))
+
+    def conjuncts(self):
+        return frozenset(self.children)
+
+    def matches(self, tags):
+        return all(child.matches(tags) for child in self.children)
+
+    def rank(self, index):
+        return _first_rank(self.children, index)
+
+    def evaluate(self, index):
+        # negated terms are subtracted instead of complemented and intersected
+        included = [c.evaluate(index) for c in self.children if not isinstance(c, Not)]
+        excluded = [c.child.evaluate(index) for c in self.children if isinstance(c, Not)]
+        if not included:
+            included = [index.get_font_set()]
+        included.sort(key=len)
+        result = set(included[0])
+        for fonts in included[1:]:
+            if not result:
+                break
+            result &= fonts
+        for fonts in excluded:
+            if not result:
+                break
+            result -= fonts
+        return result
+
+
+class Or(Node):
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = tuple(_flatten(Or, children))
+
+    def key(self):
+        return ('Or', frozenset(child.key() for child in self.children))
+
+    def matches(self, tags):
+        return any(child.matches(tags) for child in self.children)
+
+    def rank(self, index):
+        return _first_rank(self.children, index)
+
+    def evaluate(self, index):
+        result = set()
+        for child in self.children:
+            result |= child.evaluate(index)
+        return result
+
+
+def _first_rank(children, index):
+    for child in children:
+        ranks = child.rank(index)
+        if ranks is not None:
+            return ranks
+    return None
+
+
+def _flatten(cls, children):
+    for child in children:
+        if isinstance(child, cls):
+            yield from child.children
+        else:
+            yield child
+
+
+_OPERATORS = {'!': '!', '&': '&', '|': '|', '(': '(', ')': ')'}
+_WORD_END = set(_OPERATORS) | set('{}[]"')
+_KEYWORDS = {'not': '!', 'and': '&', 'or': '|'}
+
+
+def tokenize(text):
+    '''Splits query text into a list of (kind, value) tokens.
+    kind is 'tag' for {tag} terms, 'fact' for [fact] terms, 'text' for words and "quoted text",
+    otherwise the operator itself.'''
+    tokens = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c.isspace():
+            i += 1
+        elif c == '{':
+            end = text.find('}', i)
+            if end == -1:
+                raise QueryError(f"unclosed '{{' at {i}")
+            tokens.append(('tag', text[i+1:end]))
+            i = end + 1
+        elif c == '[':
+            end = text.find(']', i)
+            if end == -1:
+                raise QueryError(f"unclosed '[' at {i}")
+            tokens.append(('fact', text[i+1:end]))
+            i = end + 1
+        elif c == '"':
+            end = text.find('"', i + 1)
+            if end == -1:
+                raise QueryError(f"unclosed '\"' at {i}")
+            tokens.append(('text', text[i+1:end]))
+            i = end + 1
+        elif c in _OPERATORS:
+            tokens.append((_OPERATORS[c], c))
+            i += 1
+        else:
+            end = i
+            while end < len(text) and not text[end].isspace() and text[end] not in _WORD_END:
+                end += 1
+            if end == i:
+                raise QueryError(f"unexpected {c!r} at {i}")
+            word = text[i:end]
+            if word.lower() in _KEYWORDS:
+                tokens.append((_KEYWORDS[word.lower()], word))
+            else:
+                tokens.append(('text', word))
+            i = end
+    return tokens
+
+
+class _Parser:
+    '''Recursive descent parser, binding from tightest to loosest: ! then & then |.'''
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else 'end of query'
+            raise QueryError(f"expected {kind!r}, found {found!r}")
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QueryError(f"unexpected {self.tokens[self.pos][1]!r}")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == '|':
+            self.pos += 1
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() == '&':
+            self.pos += 1
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.peek() == '!':
+            self.pos += 1
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        if self.peek() == '(':
+            self.pos += 1
+            node = self.parse_or()
+            self.take(')')
+            return node
+        if self.peek() == 'fact':
+            return parse_fact(self.take('fact'))
+        if self.peek() == 'text':
+            # words next to each other are one name, so open sans finds Open Sans
+            words = [self.take('text')]
+            while self.peek() == 'text':
+                words.append(self.take('text'))
+            return Name(' '.join(words))
+        return Tag(self.take('tag'))
+
+
+def parse_query(text):
+    '''Parses query text into a tree of nodes with a matches(tags) method,
+    and an evaluate(index) method returning the set of matching fonts.
+    Raises QueryError if the text is not a valid query.'''
+    if text == ALL_FONTS:
+        return MatchAll()
+    return _Parser(tokenize(text)).parse()
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(text):
+    '''Returns the parsed query for text, reusing earlier parses of the same text.
+    Invalid queries match no fonts.'''
+    try:
+        return parse_query(text)
+    except QueryError:
+        return MatchNone()
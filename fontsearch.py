@@ -0,0 +1,54 @@
+from gi.repository import GLib
+
+import fontstats
+
+
+class SearchPipeline:
+    '''Runs queries against the font model and applies the results with apply_func.
+
+    search() waits for delay ms without a newer query before running one, and search_now()
+    runs it right away. apply_func(query, fonts) may be a generator, in which case it is run
+    a slice at a time from the main loop, and dropped as soon as a newer query starts.'''
+
+    def __init__(self, font_model, apply_func, delay=150):
+        self.font_model = font_model
+        self.apply_func = apply_func
+        self.delay = delay
+        self._timeout_source = None
+        self._pass_source = None
+
+    def search(self, query):
+        '''Runs query once no newer query has come in for delay ms.'''
+        self.cancel()
+        self._timeout_source = GLib.timeout_add(self.delay, self._on_timeout, query)
+
+    def search_now(self, query):
+        '''Runs query right away, replacing any pending or running query.'''
+        self.cancel()
+        fonts = self.font_model.get_matching_fonts(query)
+        apply_pass = self.apply_func(query, fonts)
+        if apply_pass is not None and self._run_slice(apply_pass):
+            self._pass_source = GLib.idle_add(self._run_slice, apply_pass)
+
+    def cancel(self):
+        '''Drops the pending query and the rest of the running filter pass.'''
+        if self._timeout_source is not None:
+            GLib.source_remove(self._timeout_source)
+            self._timeout_source = None
+        if self._pass_source is not None:
+            GLib.source_remove(self._pass_source)
+            self._pass_source = None
+
+    def _on_timeout(self, query):
+        self._timeout_source = None
+        self.search_now(query)
+        return GLib.SOURCE_REMOVE
+
+    @fontstats.timed('filter_slice')
+    def _run_slice(self, apply_pass):
+        try:
+            next(apply_pass)
+            return GLib.SOURCE_CONTINUE
+        except StopIteration:
+            self._pass_source = None
+            return GLib.SOURCE_REMOVE
@@ -0,0 +1,147 @@
+'''Visual similarity of font families, from rasterized sample glyphs.
+
+Each family's GLYPHS are drawn with PangoCairo into small cells on a common baseline, and the
+pixels are projected down to a short unit vector. Vectors are kept in a NumPy matrix cached on
+disk with the mtimes of the families' files, so only new and changed families are drawn again.
+Nearest neighbours of any number of fonts are found with one matrix product.'''
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fontfiles import get_cache_dir
+
+
+GLYPHS = 'HOaegnx'
+CELL = 32
+SCALE_DOWN = 2
+FEATURES = len(GLYPHS) * (CELL // SCALE_DOWN) ** 2
+DIMENSIONS = 128
+
+
+def _get_projection():
+    # fixed seed, so vectors from different runs can be compared
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal((FEATURES, DIMENSIONS)) / np.sqrt(DIMENSIONS)).astype(np.float32)
+
+
+def render_features(families):
+    '''Returns matrix of raw glyph pixels of families, a row per family.'''
+    import cairo
+    import gi
+    gi.require_version('PangoCairo', '1.0')
+    from gi.repository import Pango, PangoCairo
+    from fontspecimen import SpecimenLayout
+
+    descriptions = SpecimenLayout(families, 1, CELL * 3 // 4, GLYPHS)
+    surface = cairo.ImageSurface(cairo.FORMAT_A8, CELL, CELL)
+    cr = cairo.Context(surface)
+    layout = PangoCairo.create_layout(cr)
+    features = np.zeros((len(families), FEATURES), dtype=np.float32)
+    for row, family in enumerate(families):
+        layout.set_font_description(descriptions.get_description(family))
+        cells = []
+        for glyph in GLYPHS:
+            cr.set_operator(cairo.OPERATOR_CLEAR)
+            cr.paint()
+            cr.set_operator(cairo.OPERATOR_OVER)
+            layout.set_text(glyph, -1)
+            width, _ = layout.get_pixel_size()
+            # baselines line up, so x height and ascenders count
+            cr.move_to((CELL - width) / 2, CELL * 3 // 4 - layout.get_baseline() / Pango.SCALE)
+            PangoCairo.show_layout(cr, layout)
+            surface.flush()
+            pixels = np.frombuffer(surface.get_data(), dtype=np.uint8)
+            pixels = pixels.reshape(CELL, surface.get_stride())[:, :CELL]
+            cells.append(pixels.reshape(CELL // SCALE_DOWN, SCALE_DOWN,
+                                        CELL // SCALE_DOWN, SCALE_DOWN).mean(axis=(1, 3)))
+        features[row] = np.concatenate([cell.ravel() for cell in cells]) / 255
+    return features
+
+
+def to_vectors(features):
+    '''Returns unit vectors of raw features, so dot products are cosine similarities.'''
+    vectors = features @ _get_projection()
+    vectors -= vectors.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+class SimilarityIndex:
+    '''Matrix of the similarity vectors of font families, cached on disk.'''
+
+    CHUNK_SIZE = 64
+
+    def __init__(self, cache_file=None, workers=None):
+        self.cache_file = cache_file or os.path.join(get_cache_dir(), 'similarity.npz')
+        self.workers = workers
+        names, mtimes, vectors = [], np.zeros(0, dtype=np.int64), \
+            np.zeros((0, DIMENSIONS), dtype=np.float32)
+        try:
+            with np.load(self.cache_file) as cache:
+                if cache['vectors'].shape[1] == DIMENSIONS:
+                    names = [str(name) for name in cache['names']]
+                    mtimes, vectors = cache['mtimes'], cache['vectors']
+        except (OSError, ValueError, KeyError):
+            pass
+        self._set(names, mtimes, vectors)
+
+    def _set(self, names, mtimes, vectors):
+        # one attribute, so the main loop never sees names and vectors of different updates
+        self._data = (names, mtimes, vectors, {name: row for row, name in enumerate(names)})
+
+    def __len__(self):
+        return len(self._data[0])
+
+    def update(self, families, mtimes):
+        '''Draws new and changed families in a pool of processes, and drops the others.
+        mtimes is a dict of family to newest mtime of its files. Returns if anything changed.'''
+        names, old_mtimes, vectors, rows = self._data
+        keep = [family for family in families
+                if family in rows and old_mtimes[rows[family]] == mtimes.get(family, 0)]
+        kept = set(keep)
+        stale = [family for family in families if family not in kept]
+        if not stale and len(keep) == len(names):
+            return False
+        new_vectors = [vectors[[rows[family] for family in keep]]]
+        if stale:
+            chunks = [stale[i:i + self.CHUNK_SIZE] for i in range(0, len(stale), self.CHUNK_SIZE)]
+            # spawn, as forking a process that has Pango loaded is not safe
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                for features in executor.map(render_features, chunks):
+                    new_vectors.append(to_vectors(features))
+        new_names = keep + stale
+        new_mtimes = np.array([mtimes.get(family, 0) for family in new_names], dtype=np.int64)
+        self._set(new_names, new_mtimes, np.concatenate(new_vectors).astype(np.float32))
+        self.save()
+        return True
+
+    def save(self):
+        names, mtimes, vectors, _ = self._data
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file + '.tmp', 'wb') as cache:
+            np.savez(cache, names=np.array(names, dtype=str), mtimes=mtimes, vectors=vectors)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
+
+    def nearest(self, families, k):
+        '''Returns list of lists of the k families most like each of families, most similar
+        first. Families not in the index have no neighbours.'''
+        names, _, vectors, rows = self._data
+        query_rows = [rows[family] for family in families if family in rows]
+        results = {}
+        if query_rows and len(names) > 1:
+            k = min(k, len(names) - 1)
+            scores = vectors @ vectors[query_rows].T
+            # a family is not its own neighbour
+            scores[query_rows, np.arange(len(query_rows))] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]
+            order = np.take_along_axis(-scores, top, axis=0).argsort(axis=0, kind='stable')
+            top = np.take_along_axis(top, order, axis=0)
+            for column, row in enumerate(query_rows):
+                results[names[row]] = [names[i] for i in top[:, column]]
+        return [results.get(family, []) for family in families]
+
+    def similar(self, family, k):
+        return self.nearest([family], k)[0]
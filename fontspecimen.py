@@ -0,0 +1,101 @@
+import gi
+gi.require_version('Pango', '1.0')
+gi.require_version('PangoCairo', '1.0')
+from gi.repository import Pango, PangoCairo
+
+
+def list_font_families():
+    '''Returns list of names of the font families known to Pango, without needing a display.'''
+    return [family.get_name() for family in PangoCairo.FontMap.get_default().list_families()]
+
+
+class SpecimenLayout:
+    '''Lays out a specimen of fonts in columns, each font as its name in a small sans serif font
+    over the view text in the font, and splits the rows of fonts into pages.
+
+    paginate measures every row once. After that draw_page only sets the text and font of
+    two cached layouts, so pages can be drawn again cheaply and in any order.'''
+
+    def __init__(self, font_list, columns, view_size, view_text, margin_btwn=10, arial_size=10):
+        self.font_list = font_list
+        self.columns = columns
+        self.view_size = view_size
+        self.view_text = view_text
+        self.margin_btwn = margin_btwn
+        self.arial_size = arial_size
+        self.box_width = 0
+        # list of pages, each a list of (index of first font, y) of its rows
+        self.pages = [[]]
+        self._descriptions = {}
+        self._name_layout = None
+        self._sample_layout = None
+
+    def get_description(self, font):
+        '''Returns font description of font at the view size, created once per font.'''
+        description = self._descriptions.get(font)
+        if description is None:
+            description = Pango.FontDescription()
+            description.set_family(font)
+            description.set_absolute_size(self.view_size * Pango.SCALE)
+            self._descriptions[font] = description
+        return description
+
+    def prepare(self, cr, width):
+        '''Creates the layouts for pages of width, in the units of cr. paginate calls this,
+        but pages split by another SpecimenLayout only need it before draw_page.'''
+        self.box_width = (width - (self.columns - 1) * self.margin_btwn) / self.columns
+        self._create_layouts(cr)
+
+    def _create_layouts(self, cr):
+        name_description = Pango.FontDescription.from_string('sans serif')
+        name_description.set_absolute_size(self.arial_size * Pango.SCALE)
+        self._name_layout = PangoCairo.create_layout(cr)
+        self._name_layout.set_font_description(name_description)
+        self._name_layout.set_ellipsize(Pango.EllipsizeMode.END)
+        self._name_layout.set_width(int(self.box_width * Pango.SCALE))
+
+        self._sample_layout = PangoCairo.create_layout(cr)
+        self._sample_layout.set_ellipsize(Pango.EllipsizeMode.END)
+        self._sample_layout.set_width(int(self.box_width * Pango.SCALE))
+        self._sample_layout.set_height(self.view_size * Pango.SCALE)
+        if self.view_text != "{font_name}":
+            self._sample_layout.set_markup(self.view_text, -1)
+
+    def _set_font(self, font):
+        self._name_layout.set_text(font, -1)
+        self._sample_layout.set_font_description(self.get_description(font))
+        if self.view_text == "{font_name}":
+            self._sample_layout.set_text(font, -1)
+
+    def paginate(self, cr, width, height):
+        '''Measures the rows of fonts for pages of width by height, in the units of cr.
+        Returns number of pages.'''
+        self.prepare(cr, width)
+        self.pages = [[]]
+        y = 0
+        for start in range(0, len(self.font_list), self.columns):
+            row_height = 0
+            for font in self.font_list[start:start + self.columns]:
+                self._set_font(font)
+                row_height = max(row_height, self._name_layout.get_pixel_size()[1] + 3 +
+                                 self._sample_layout.get_pixel_size()[1])
+            if y + row_height > height and self.pages[-1]:
+                self.pages.append([])
+                y = 0
+            self.pages[-1].append((start, y))
+            y += row_height + self.margin_btwn
+        return len(self.pages)
+
+    def draw_page(self, cr, page_num):
+        '''Draws page page_num of the last pagination on cr.'''
+        PangoCairo.update_layout(cr, self._name_layout)
+        PangoCairo.update_layout(cr, self._sample_layout)
+        cr.set_source_rgb(0, 0, 0)
+        for start, y in self.pages[page_num]:
+            for i, font in enumerate(self.font_list[start:start + self.columns]):
+                x = i * (self.box_width + self.margin_btwn)
+                self._set_font(font)
+                cr.move_to(x, y)
+                PangoCairo.show_layout(cr, self._name_layout)
+                cr.move_to(x, y + self._name_layout.get_pixel_size()[1] + 3)
+                PangoCairo.show_layout(cr, self._sample_layout)
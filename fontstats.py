@@ -0,0 +1,115 @@
+'''Timings and counters of the slow paths, for finding out where a stall went.
+
+Off by default. Set FONTCAT_STATS=1 to turn them on at start, or FONTCAT_STATS=file.json to
+also dump them to that file on exit, or turn them on from the menu. When off, a timed call
+costs one check of the enabled flag.'''
+import functools
+import json
+import os
+import threading
+import time
+
+
+_setting = os.environ.get('FONTCAT_STATS', '')
+enabled = _setting not in ('', '0')
+# file to dump the stats to on exit, if any
+dump_filename = _setting if _setting.endswith('.json') else None
+
+_lock = threading.Lock()
+_operations = {}
+_counters = {}
+
+
+class _Operation:
+    '''Call count, total and max seconds, and histogram of calls by power of two microseconds.'''
+    __slots__ = ('calls', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        # bucket n holds calls of less than 2**n us
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        '''Returns upper bound in ms of the calls up to fraction of all calls.'''
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.calls:
+                return 2 ** bucket / 1000
+        return 0.0
+
+
+def set_enabled(on):
+    global enabled
+    enabled = on
+
+
+def record(name, seconds):
+    '''Adds a call of seconds to operation name.'''
+    with _lock:
+        operation = _operations.get(name)
+        if operation is None:
+            operation = _operations[name] = _Operation()
+        operation.add(seconds)
+
+
+def count(name, n=1):
+    '''Adds n to counter name.'''
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def timed(name):
+    '''Decorator timing each call of the function as a call of operation name.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    '''Returns dict of the operations' latencies in ms and histograms, and the counters.'''
+    with _lock:
+        operations = {
+            name: {
+                'calls': operation.calls,
+                'total_ms': operation.total * 1000,
+                'mean_ms': operation.total * 1000 / operation.calls,
+                'max_ms': operation.max * 1000,
+                'p50_ms': operation.percentile(0.5),
+                'p95_ms': operation.percentile(0.95),
+                'histogram': {f'<{2 ** bucket}us': calls
+                              for bucket, calls in sorted(operation.buckets.items())},
+            }
+            for name, operation in _operations.items()}
+        return {'enabled': enabled, 'operations': operations, 'counters': dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _operations.clear()
+        _counters.clear()
+
+
+def dump(filename):
+    '''Writes the stats to filename as json.'''
+    with open(filename, 'w') as stats_file:
+        json.dump(get_stats(), stats_file, indent=2)
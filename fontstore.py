@@ -0,0 +1,665 @@
+import array
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+SNAPSHOT_EXTENSIONS = ('.snap',)
+
+
+class StoreLockedError(Exception):
+    '''Raised when the tags are locked by another process, see JsonStore.lock.'''
+
+
+class JsonStore:
+    '''Tags file in json, with an append-only journal of the changes made since it was written.
+
+    The journal is a file of one json list per line, next to the tags file. Replaying a
+    record is idempotent, so replaying records that are already in the tags file is harmless.
+    That is what makes compacting safe: the journal is moved aside, the tags file is replaced
+    atomically, and only then is the moved journal removed.'''
+
+    lazy = False
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.journal_name = filename + '.journal'
+        self.old_journal_name = self.journal_name + '.old'
+        # number of records not in the tags file yet
+        self.changes = 0
+        self._journal = None
+        self._compact_thread = None
+        self._lock_file = None
+
+    def read(self):
+        '''Returns dict of tag to list of fonts from the tags file, and list of journal records,
+        oldest first. A missing tags file is read as no tags, and torn records are skipped.'''
+        try:
+            with open(self.filename) as tags_file:
+                tags_list = json.load(tags_file)
+        except FileNotFoundError:
+            tags_list = {}
+        return tags_list, self._read_journal()
+
+    def _read_journal(self):
+        records = []
+        for name in (self.old_journal_name, self.journal_name):
+            try:
+                with open(name) as journal_file:
+                    for line in journal_file:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            pass
+            except FileNotFoundError:
+                pass
+        self.changes = len(records)
+        return records
+
+    def append(self, *record):
+        '''Appends record to the journal.'''
+        if self._journal is None:
+            self._journal = open(self.journal_name, 'a')
+        self._journal.write(json.dumps(record) + '\n')
+        self._journal.flush()
+        self.changes += 1
+
+    def write(self, get_tags_list):
+        '''Replaces the tags file with the tags returned by get_tags_list, and empties the journal.'''
+        self.wait()
+        self._rotate_journal()
+        self._write_tags(get_tags_list())
+
+    def compact(self, get_tags_list):
+        '''Replaces the tags file with the tags returned by get_tags_list in a background thread,
+        and empties the journal. Does nothing if the last compaction is still running.'''
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        tags_list = get_tags_list()
+        self._rotate_journal()
+        self._compact_thread = threading.Thread(target=self._write_tags, args=(tags_list,),
+                                                daemon=True)
+        self._compact_thread.start()
+
+    def import_tags(self, tags_list):
+        '''Replaces all tags with those of tags_list, a dict of tag to list of fonts.'''
+        self.write(lambda: tags_list)
+
+    def lock(self, wait=False):
+        '''Locks the tags against changes by other processes until close. A process writes the
+        tags file from what it has in memory, which does not have the records other processes
+        journaled, so only one process at a time may change the tags. Raises StoreLockedError
+        if another process has them locked, or with wait, waits for it to close them.
+        Does nothing where there is no fcntl.'''
+        if fcntl is None or self._lock_file is not None:
+            return
+        self._lock_file = open(self.filename + '.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise StoreLockedError(f"{self.filename} is open in another FontCat process")
+
+    def wait(self):
+        '''Waits for the running compaction, if there is one.'''
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+            self._compact_thread = None
+
+    def close(self):
+        self.wait()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _rotate_journal(self):
+        '''Moves the journal aside, so records appended from now on go to a new journal.'''
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self.changes = 0
+        if not os.path.exists(self.journal_name):
+            return
+        if os.path.exists(self.old_journal_name):
+            # left by a compaction that did not finish, so keep both
+            with open(self.journal_name) as journal_file, \
+                    open(self.old_journal_name, 'a') as old_journal_file:
+                old_journal_file.write(journal_file.read())
+            os.remove(self.journal_name)
+        else:
+            os.replace(self.journal_name, self.old_journal_name)
+
+    def _write_tags(self, tags_list):
+        self._write_file(tags_list)
+        try:
+            os.remove(self.old_journal_name)
+        except FileNotFoundError:
+            pass
+
+    def _write_file(self, tags_list):
+        tmp_name = self.filename + '.tmp'
+        with open(tmp_name, 'w') as tags_file:
+            json.dump(tags_list, tags_file)
+            tags_file.flush()
+            os.fsync(tags_file.fileno())
+        os.replace(tmp_name, self.filename)
+
+
+# magic, version, crc32 of the rest of the file, size and mtime of the json tags file it is
+# a copy of, numbers of fonts, tags and tagged fonts, sizes of the font and tag names
+_SNAPSHOT_HEADER = struct.Struct('<8sIIqqIIIII')
+_SNAPSHOT_MAGIC = b'FCATSNAP'
+SNAPSHOT_VERSION = 1
+
+
+def _to_bytes(numbers):
+    numbers = array.array('I', numbers)
+    if sys.byteorder == 'big':
+        numbers.byteswap()
+    return numbers.tobytes()
+
+
+def write_snapshot(filename, tags_list, source=None):
+    '''Writes tags_list, a dict of tag to list of fonts, to a snapshot file, see SnapshotStore.
+    source is the os.stat of the json tags file the snapshot is a copy of, if any.'''
+    tags = list(tags_list)
+    font_names = sorted({font.encode() for fonts in tags_list.values() for font in fonts})
+    font_ids = {name.decode(): font_id for font_id, name in enumerate(font_names)}
+    tag_names = [tag.encode() for tag in tags]
+    tag_fonts = [[font_ids[font] for font in dict.fromkeys(tags_list[tag])] for tag in tags]
+    font_tags = [[] for _ in font_names]
+    for tag_id, fonts in enumerate(tag_fonts):
+        for font_id in fonts:
+            font_tags[font_id].append(tag_id)
+
+    def offsets(lists):
+        ends = [0]
+        for items in lists:
+            ends.append(ends[-1] + len(items))
+        return _to_bytes(ends)
+
+    body = b''.join((
+        offsets(font_names), offsets(tag_names), offsets(tag_fonts), offsets(font_tags),
+        _to_bytes(font_id for fonts in tag_fonts for font_id in fonts),
+        _to_bytes(tag_id for tag_ids in font_tags for tag_id in tag_ids),
+        b''.join(font_names), b''.join(tag_names)))
+    header = _SNAPSHOT_HEADER.pack(
+        _SNAPSHOT_MAGIC, SNAPSHOT_VERSION, zlib.crc32(body),
+        source.st_size if source else -1, source.st_mtime_ns if source else -1,
+        len(font_names), len(tags), sum(len(fonts) for fonts in tag_fonts),
+        sum(len(name) for name in font_names), sum(len(name) for name in tag_names))
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as snapshot_file:
+        snapshot_file.write(header)
+        snapshot_file.write(body)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(tmp_name, filename)
+
+
+class _Snapshot:
+    '''Memory mapped snapshot file. Arrays and names are decoded as they are asked for.'''
+
+    def __init__(self, filename=None):
+        self.source = None
+        self.tags = []
+        self.tag_ids = {}
+        self._map = None
+        if filename is None:
+            self.num_fonts = 0
+            return
+        with open(filename, 'rb') as snapshot_file:
+            try:
+                self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f'{filename} is empty, not a tags snapshot')
+        if len(self._map) < _SNAPSHOT_HEADER.size:
+            self.close()
+            raise ValueError(f'{filename} is not a tags snapshot')
+        (magic, version, crc, source_size, source_mtime, self.num_fonts, num_tags, num_tagged,
+         font_names_size, tag_names_size) = _SNAPSHOT_HEADER.unpack_from(self._map)
+        if magic != _SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a tags snapshot of version {SNAPSHOT_VERSION}')
+        if zlib.crc32(memoryview(self._map)[_SNAPSHOT_HEADER.size:]) != crc:
+            self.close()
+            raise ValueError(f'{filename} is corrupt')
+        if source_size >= 0:
+            self.source = (source_size, source_mtime)
+
+        position = _SNAPSHOT_HEADER.size
+        sections = {}
+        for name, size in (('font_names', 4 * (self.num_fonts + 1)),
+                           ('tag_names', 4 * (num_tags + 1)),
+                           ('tag_fonts', 4 * (num_tags + 1)), ('font_tags', 4 * (self.num_fonts + 1)),
+                           ('tag_font_ids', 4 * num_tagged), ('font_tag_ids', 4 * num_tagged),
+                           ('font_name_bytes', font_names_size), ('tag_name_bytes', tag_names_size)):
+            sections[name] = position
+            position += size
+        self._sections = sections
+        self._offsets = {}
+        # tag names are few, and needed for every lookup by name
+        ends = self._get_array('tag_names', num_tags + 1)
+        position = sections['tag_name_bytes']
+        self.tags = [self._map[position + ends[i]:position + ends[i + 1]].decode()
+                     for i in range(num_tags)]
+        self.tag_ids = {tag: tag_id for tag_id, tag in enumerate(self.tags)}
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _get_array(self, section, length):
+        numbers = array.array('I')
+        numbers.frombytes(self._map[self._sections[section]:self._sections[section] + 4 * length])
+        if sys.byteorder == 'big':
+            numbers.byteswap()
+        return numbers
+
+    def _get_offsets(self, section):
+        '''Returns array of the offsets in section, decoded once on first use.'''
+        offsets = self._offsets.get(section)
+        if offsets is None:
+            length = (len(self.tags) if section.startswith('tag') else self.num_fonts) + 1
+            offsets = self._offsets[section] = self._get_array(section, length)
+        return offsets
+
+    def _get_ids(self, offsets, ids, i):
+        offsets = self._get_offsets(offsets)
+        return struct.unpack_from(f'<{offsets[i + 1] - offsets[i]}I', self._map,
+                                  self._sections[ids] + 4 * offsets[i])
+
+    def get_font_name(self, font_id):
+        offsets = self._get_offsets('font_names')
+        position = self._sections['font_name_bytes']
+        return self._map[position + offsets[font_id]:position + offsets[font_id + 1]].decode()
+
+    def find_font(self, font_name):
+        '''Returns id of font_name, or None if it has no tags, by bisecting the sorted names.'''
+        if not self.num_fonts:
+            return None
+        name = font_name.encode()
+        offsets = self._get_offsets('font_names')
+        position = self._sections['font_name_bytes']
+        low, high = 0, self.num_fonts
+        while low < high:
+            middle = (low + high) // 2
+            if self._map[position + offsets[middle]:position + offsets[middle + 1]] < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.num_fonts and self.get_font_name(low) == font_name:
+            return low
+        return None
+
+    def count(self, tag_id):
+        offsets = self._get_offsets('tag_fonts')
+        return offsets[tag_id + 1] - offsets[tag_id]
+
+    def get_tag_fonts(self, tag_id):
+        offsets = self._get_offsets('font_names')
+        names = self._map
+        position = self._sections['font_name_bytes']
+        return [names[position + offsets[font_id]:position + offsets[font_id + 1]].decode()
+                for font_id in self._get_ids('tag_fonts', 'tag_font_ids', tag_id)]
+
+    def get_font_tags(self, font_id):
+        return [self.tags[tag_id] for tag_id in self._get_ids('font_tags', 'font_tag_ids', font_id)]
+
+
+class SnapshotStore(JsonStore):
+    '''Tags in a binary snapshot file, memory mapped, with the journal of JsonStore for the
+    changes made since it was written.
+
+    The snapshot has a version and a checksum in its header, then the names of the fonts, sorted
+    so a font is found by bisection, the names of the tags, and arrays of the font ids of each
+    tag and the tag ids of each font. Only the header and the tag names are read on open, and
+    the fonts of a tag when the model first asks for them. Tags changed since the snapshot was
+    written are held in memory with all their fonts.
+
+    Next to a json tags file, as tags.json.snap, the snapshot is a copy of it: both are written,
+    and the snapshot is only read while the tags file has the size and mtime it had then.
+    Otherwise the tags file is read once to write the snapshot again.'''
+
+    lazy = True
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        if filename.endswith(SNAPSHOT_EXTENSIONS):
+            self.snapshot_name = filename
+        else:
+            self.snapshot_name = filename + '.snap'
+        self._snapshot = None
+        self._open_snapshot()
+        for op, *args in self._read_journal():
+            self._apply(op, *args)
+
+    def _open_snapshot(self):
+        if self._snapshot is not None:
+            self._snapshot.close()
+        # tag to dict of its fonts, of tags changed since the snapshot, empty for removed tags
+        self._changed = {}
+        if self.snapshot_name == self.filename:
+            # a snapshot of its own, which is all there is
+            self._snapshot = _Snapshot(self.snapshot_name if os.path.exists(self.snapshot_name)
+                                       else None)
+            return
+        try:
+            source = os.stat(self.filename)
+        except FileNotFoundError:
+            # like a missing tags file, no tags
+            self._snapshot = _Snapshot()
+            return
+        try:
+            self._snapshot = _Snapshot(self.snapshot_name)
+            if self._snapshot.source == (source.st_size, source.st_mtime_ns):
+                return
+            self._snapshot.close()
+        except (OSError, ValueError):
+            pass
+        # the tags file changed since the snapshot was written, by hand or by another program
+        with open(self.filename) as tags_file:
+            write_snapshot(self.snapshot_name, json.load(tags_file), os.stat(self.filename))
+        self._snapshot = _Snapshot(self.snapshot_name)
+
+    def read(self):
+        '''Nothing is read up front, see get_tags, get_tag_fonts and get_font_tags.'''
+        return {}, []
+
+    def get_tags(self):
+        '''Returns list of all tags, those of the snapshot first.'''
+        tags = [tag for tag in self._snapshot.tags if self._changed.get(tag, True)]
+        tags.extend(tag for tag, fonts in self._changed.items()
+                    if fonts and tag not in self._snapshot.tag_ids)
+        return tags
+
+    def has_tag(self, tag):
+        if tag in self._changed:
+            return bool(self._changed[tag])
+        return tag in self._snapshot.tag_ids
+
+    def count(self, tag):
+        '''Returns number of fonts with tag.'''
+        if tag in self._changed:
+            return len(self._changed[tag])
+        tag_id = self._snapshot.tag_ids.get(tag)
+        return 0 if tag_id is None else self._snapshot.count(tag_id)
+
+    def counts(self):
+        '''Returns dict of each tag to its number of fonts, in the order of get_tags.'''
+        return {tag: self.count(tag) for tag in self.get_tags()}
+
+    def get_tag_fonts(self, tag):
+        '''Returns list of fonts with tag.'''
+        if tag in self._changed:
+            return list(self._changed[tag])
+        tag_id = self._snapshot.tag_ids.get(tag)
+        return [] if tag_id is None else self._snapshot.get_tag_fonts(tag_id)
+
+    def get_font_tags(self, font):
+        '''Returns list of tags of font.'''
+        font_id = self._snapshot.find_font(font)
+        tags = [] if font_id is None else [tag for tag in self._snapshot.get_font_tags(font_id)
+                                           if tag not in self._changed]
+        tags.extend(tag for tag, fonts in self._changed.items() if font in fonts)
+        return tags
+
+    def append(self, op, *args):
+        '''Journals a change record, and applies it to the tags in memory.'''
+        super().append(op, *args)
+        self._apply(op, *args)
+
+    def _apply(self, op, *args):
+        tag = args[-1]
+        fonts = self._changed.get(tag)
+        if fonts is None:
+            fonts = self._changed[tag] = dict.fromkeys(self.get_tag_fonts(tag))
+        if op == 'add':
+            fonts[args[0]] = None
+        elif op == 'rmv':
+            fonts.pop(args[0], None)
+        elif op == 'add_many':
+            fonts.update(dict.fromkeys(args[0]))
+        elif op == 'rmv_many':
+            for font in args[0]:
+                fonts.pop(font, None)
+        elif op == 'rmv_all':
+            fonts.clear()
+
+    def write(self, get_tags_list):
+        '''Writes the snapshot, and the tags file next to it, and maps the new snapshot.'''
+        super().write(get_tags_list)
+        self._open_snapshot()
+
+    def close(self):
+        super().close()
+        self._snapshot.close()
+
+    def export_tags(self):
+        '''Returns dict of each tag to list of fonts with the tag, the format of the tags file.'''
+        return {tag: self.get_tag_fonts(tag) for tag in self.get_tags()}
+
+    def _write_file(self, tags_list):
+        source = None
+        if self.snapshot_name != self.filename:
+            # the tags file first, so the snapshot has its size and mtime
+            super()._write_file(tags_list)
+            source = os.stat(self.filename)
+        write_snapshot(self.snapshot_name, tags_list, source)
+
+
+class SqliteStore:
+    '''Tags in an SQLite database, with tables of fonts, tags and the tags of each font.
+
+    The model reads tags from it lazily, and each tag change is a row level update.
+    Each change record is committed on its own, so no change is lost if the program is
+    killed. That costs a sync of the database per record, which is why tagging many fonts
+    at once is one add_many or rmv_many record rather than one per font.'''
+
+    lazy = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        # changes are committed as they are made, so none are ever pending
+        self.changes = 0
+        self.connection = sqlite3.connect(filename, isolation_level=None)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS fonts (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS font_tags (
+                font_id INTEGER NOT NULL REFERENCES fonts (id),
+                tag_id INTEGER NOT NULL REFERENCES tags (id),
+                PRIMARY KEY (font_id, tag_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS font_tags_by_tag ON font_tags (tag_id, font_id);
+        ''')
+
+    def read(self):
+        '''Nothing is read up front, see get_tags, get_tag_fonts and get_font_tags.'''
+        return {}, []
+
+    def get_tags(self):
+        '''Returns list of all tags, oldest first.'''
+        return [name for name, in self.connection.execute('SELECT name FROM tags ORDER BY id')]
+
+    def has_tag(self, tag):
+        return self.connection.execute(
+            'SELECT 1 FROM tags WHERE name = ?', (tag,)).fetchone() is not None
+
+    def count(self, tag):
+        '''Returns number of fonts with tag.'''
+        return self.connection.execute('''
+            SELECT COUNT(*) FROM font_tags JOIN tags ON tags.id = font_tags.tag_id
+            WHERE tags.name = ?''', (tag,)).fetchone()[0]
+
+    def counts(self):
+        '''Returns dict of each tag to its number of fonts, oldest tag first.'''
+        return dict(self.connection.execute('''
+            SELECT tags.name, COUNT(font_tags.font_id) FROM tags
+            LEFT JOIN font_tags ON font_tags.tag_id = tags.id
+            GROUP BY tags.id ORDER BY tags.id'''))
+
+    def get_tag_fonts(self, tag):
+        '''Returns list of fonts with tag.'''
+        return [name for name, in self.connection.execute('''
+            SELECT fonts.name FROM font_tags
+            JOIN tags ON tags.id = font_tags.tag_id JOIN fonts ON fonts.id = font_tags.font_id
+            WHERE tags.name = ?''', (tag,))]
+
+    def get_font_tags(self, font):
+        '''Returns list of tags of font, oldest tag first.'''
+        return [name for name, in self.connection.execute('''
+            SELECT tags.name FROM font_tags
+            JOIN fonts ON fonts.id = font_tags.font_id JOIN tags ON tags.id = font_tags.tag_id
+            WHERE fonts.name = ? ORDER BY tags.id''', (font,))]
+
+    def append(self, op, *args):
+        '''Applies and commits a change record, the same records JsonStore journals.'''
+        with self.connection:
+            self.connection.execute('BEGIN')
+            self._apply(op, *args)
+
+    def _apply(self, op, *args):
+        if op == 'add':
+            font, tag = args
+            self.connection.execute('INSERT OR IGNORE INTO fonts (name) VALUES (?)', (font,))
+            self.connection.execute('INSERT OR IGNORE INTO tags (name) VALUES (?)', (tag,))
+            self.connection.execute('''
+                INSERT OR IGNORE INTO font_tags (font_id, tag_id)
+                SELECT fonts.id, tags.id FROM fonts, tags WHERE fonts.name = ? AND tags.name = ?''',
+                                    (font, tag))
+        elif op == 'rmv':
+            font, tag = args
+            self.connection.execute('''
+                DELETE FROM font_tags
+                WHERE font_id = (SELECT id FROM fonts WHERE name = ?)
+                AND tag_id = (SELECT id FROM tags WHERE name = ?)''', (font, tag))
+            self.connection.execute('''
+                DELETE FROM tags WHERE name = ?
+                AND NOT EXISTS (SELECT 1 FROM font_tags WHERE tag_id = tags.id)''', (tag,))
+        elif op == 'add_many':
+            fonts, tag = args
+            self.connection.executemany('INSERT OR IGNORE INTO fonts (name) VALUES (?)',
+                                        ((font,) for font in fonts))
+            self.connection.execute('INSERT OR IGNORE INTO tags (name) VALUES (?)', (tag,))
+            self.connection.executemany('''
+                INSERT OR IGNORE INTO font_tags (font_id, tag_id)
+                SELECT fonts.id, tags.id FROM fonts, tags WHERE fonts.name = ? AND tags.name = ?''',
+                                        ((font, tag) for font in fonts))
+        elif op == 'rmv_many':
+            fonts, tag = args
+            self.connection.executemany('''
+                DELETE FROM font_tags
+                WHERE font_id = (SELECT id FROM fonts WHERE name = ?)
+                AND tag_id = (SELECT id FROM tags WHERE name = ?)''', ((font, tag) for font in fonts))
+            self.connection.execute('''
+                DELETE FROM tags WHERE name = ?
+                AND NOT EXISTS (SELECT 1 FROM font_tags WHERE tag_id = tags.id)''', (tag,))
+        elif op == 'rmv_all':
+            tag, = args
+            self.connection.execute('''
+                DELETE FROM font_tags WHERE tag_id = (SELECT id FROM tags WHERE name = ?)''', (tag,))
+            self.connection.execute('DELETE FROM tags WHERE name = ?', (tag,))
+
+    def write(self, get_tags_list):
+        '''Nothing to write, each change is committed as it is made, so get_tags_list
+        is not called.'''
+
+    def compact(self, get_tags_list):
+        pass
+
+    def lock(self, wait=False):
+        '''Nothing to lock, SQLite locks the database for each change, and no process writes
+        the tags from memory.'''
+
+    def wait(self):
+        pass
+
+    def close(self):
+        self.connection.close()
+
+    def import_tags(self, tags_list):
+        '''Replaces all tags with those of tags_list, a dict of tag to list of fonts.'''
+        with self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.execute('DELETE FROM font_tags')
+            self.connection.execute('DELETE FROM tags')
+            self.connection.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)',
+                                        ((tag,) for tag in tags_list))
+            self.connection.executemany('INSERT OR IGNORE INTO fonts (name) VALUES (?)',
+                                        ((font,) for fonts in tags_list.values() for font in fonts))
+            self.connection.executemany('''
+                INSERT OR IGNORE INTO font_tags (font_id, tag_id)
+                SELECT fonts.id, tags.id FROM fonts, tags WHERE fonts.name = ? AND tags.name = ?''',
+                                        ((font, tag) for tag, fonts in tags_list.items()
+                                         for font in fonts))
+
+    def export_tags(self):
+        '''Returns dict of each tag to list of fonts with the tag, the format of the tags file.'''
+        tags_list = {tag: [] for tag in self.get_tags()}
+        for tag, font in self.connection.execute('''
+                SELECT tags.name, fonts.name FROM font_tags
+                JOIN tags ON tags.id = font_tags.tag_id JOIN fonts ON fonts.id = font_tags.font_id
+                ORDER BY font_tags.tag_id, font_tags.font_id'''):
+            tags_list[tag].append(font)
+        return tags_list
+
+
+def open_store(filename, backend=None):
+    '''Returns store for filename. backend is 'json', 'snapshot' or 'sqlite', by default
+    picked by the extension of filename. A json tags file with a snapshot next to it is opened
+    with the snapshot.'''
+    if backend is None:
+        if filename.endswith(SQLITE_EXTENSIONS):
+            backend = 'sqlite'
+        elif filename.endswith(SNAPSHOT_EXTENSIONS) or os.path.exists(filename + '.snap'):
+            backend = 'snapshot'
+        else:
+            backend = 'json'
+    return {'json': JsonStore, 'snapshot': SnapshotStore, 'sqlite': SqliteStore}[backend](filename)
+
+
+def get_collections_name(filename):
+    '''Returns name of the file of the smart collections kept next to tags file filename.
+    A snapshot is named after the tags file it is paired with, so tags.json, tags.json.snap
+    and tags.db all share tags.collections.json.'''
+    if filename.endswith(SNAPSHOT_EXTENSIONS):
+        filename = os.path.splitext(filename)[0]
+    return os.path.splitext(filename)[0] + '.collections.json'
+
+
+def read_collections(filename):
+    '''Returns dict of the name of each smart collection to its query, from the file next to
+    tags file filename, or an empty dict if there is none.'''
+    try:
+        with open(get_collections_name(filename)) as collections_file:
+            return json.load(collections_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_collections(filename, collections):
+    '''Saves collections, a dict like read_collections returns, next to tags file filename.'''
+    collections_name = get_collections_name(filename)
+    tmp_name = collections_name + '.tmp'
+    with open(tmp_name, 'w') as collections_file:
+        json.dump(collections, collections_file, indent=1)
+        collections_file.flush()
+        os.fsync(collections_file.fileno())
+    os.replace(tmp_name, collections_name)
@@ -0,0 +1,153 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cairo
+import gi
+gi.require_version('PangoCairo', '1.0')
+from gi.repository import GLib, PangoCairo
+
+from fontfiles import list_font_files, get_family_mtimes
+
+
+class ThumbnailCache:
+    '''On disk cache of font preview images, rendered by a pool of worker threads.
+
+    Previews are keyed by font family, mtime of its font files, view size and view text.
+    They are rendered black on transparent, to be used as a mask in the theme's text color.
+    Once the cache is bigger than max_bytes, the least recently used previews are removed.'''
+
+    MAX_WIDTH = 800
+    # decoded previews kept in memory, about a few screens of cards
+    MAX_SURFACES = 200
+
+    def __init__(self, cache_dir=None, max_bytes=64 * 1024 * 1024, workers=None,
+                 on_fonts_changed=None):
+        self.cache_dir = cache_dir or os.path.join(
+            GLib.get_user_cache_dir(), 'fontcat', 'thumbnails')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.on_fonts_changed = on_fonts_changed
+
+        self._mtimes_file = os.path.join(self.cache_dir, 'mtimes.json')
+        try:
+            with open(self._mtimes_file) as mtimes_file:
+                self.mtimes = json.load(mtimes_file)
+        except (OSError, ValueError):
+            self.mtimes = {}
+
+        self._pending = {}
+        # most recently used last
+        self._surfaces = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self._executor.submit(self._refresh_mtimes)
+
+    def close(self):
+        '''Drops previews not yet rendered and lets the workers exit.'''
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_path(self, family, size, text):
+        key = f'{family}\0{self.mtimes.get(family, 0)}\0{size}\0{text}'
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.png')
+
+    def lookup(self, family, size, text):
+        '''Returns preview as a cairo surface if it was loaded lately, otherwise None.
+        Does not touch the disk, so it can be called for every card that is bound.'''
+        path = self.get_path(family, size, text)
+        surface = self._surfaces.get(path)
+        if surface is not None:
+            self._surfaces.move_to_end(path)
+        return surface
+
+    def request(self, family, size, text, callback):
+        '''Loads preview in the background, rendering it first if it is not cached, then calls
+        callback(family, size, text, surface) from the main loop. surface is None if the preview
+        could not be rendered.'''
+        path = self.get_path(family, size, text)
+        if path in self._pending:
+            self._pending[path].append(callback)
+            return
+        self._pending[path] = [callback]
+        future = self._executor.submit(self._load, family, size, text, path)
+        future.add_done_callback(
+            lambda f: GLib.idle_add(self._deliver, family, size, text, path, f))
+
+    def _deliver(self, family, size, text, path, future):
+        callbacks = self._pending.pop(path, [])
+        if future.cancelled():
+            return GLib.SOURCE_REMOVE
+        surface = None if future.exception() is not None else future.result()
+        if surface is not None:
+            self._surfaces[path] = surface
+            if len(self._surfaces) > self.MAX_SURFACES:
+                self._surfaces.popitem(last=False)
+        for callback in callbacks:
+            callback(family, size, text, surface)
+        return GLib.SOURCE_REMOVE
+
+    def _load(self, family, size, text, path):
+        try:
+            surface = cairo.ImageSurface.create_from_png(path)
+            os.utime(path)
+            return surface
+        except (OSError, cairo.Error):
+            return self._render(family, size, text, path)
+
+    def _render(self, family, size, text, path):
+        # the default PangoCairo font map is per thread, so workers do not share font state
+        markup = f"<span font=\"{family} {size}\">{text}</span>"
+        layout = PangoCairo.create_layout(cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1)))
+        layout.set_markup(markup, -1)
+        width, height = layout.get_pixel_size()
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                     min(max(width, 1), self.MAX_WIDTH), max(height, 1))
+        cr = cairo.Context(surface)
+        PangoCairo.update_layout(cr, layout)
+        cr.set_source_rgb(0, 0, 0)
+        PangoCairo.show_layout(cr, layout)
+        surface.write_to_png(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self._evict(os.path.getsize(path))
+        return surface
+
+    def _evict(self, added_bytes):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                                        if entry.name.endswith('.png'))
+            else:
+                self._total_bytes += added_bytes
+            if self._total_bytes <= self.max_bytes:
+                return
+            entries = sorted((entry for entry in os.scandir(self.cache_dir)
+                              if entry.name.endswith('.png')),
+                             key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if self._total_bytes <= self.max_bytes * 0.9:
+                    break
+                try:
+                    self._total_bytes -= entry.stat().st_size
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def _refresh_mtimes(self):
+        '''Gets the mtimes of the font files again, so previews of changed fonts are rendered again.'''
+        mtimes = get_family_mtimes(list_font_files())
+        if mtimes == self.mtimes:
+            return
+        with open(self._mtimes_file + '.tmp', 'w') as mtimes_file:
+            json.dump(mtimes, mtimes_file)
+        os.replace(self._mtimes_file + '.tmp', self._mtimes_file)
+        GLib.idle_add(self._set_mtimes, mtimes)
+
+    def _set_mtimes(self, mtimes):
+        self.mtimes = mtimes
+        if self.on_fonts_changed is not None:
+            self.on_fonts_changed()
+        return GLib.SOURCE_REMOVE
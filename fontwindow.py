@@ -1,33 +1,90 @@
+import threading
+
 from fontmodel import FontCatModel
+from fontmeta import FontMetaIndex
 from fontprint import FontPrint
-from customdialog import EntryDialog
+from fontquery import ALL_FONTS
+from fontsearch import SearchPipeline
+from fontfiles import (read_font_list_cache, write_font_list_cache, list_font_files,
+                       get_family_mtimes, list_font_families, list_system_fonts, get_font_dirs,
+                       get_fontconfig_fingerprint, read_session, write_session)
+from customdialog import EntryDialog, StatsDialog, save_stats
+import fontstats
+
+try:
+    from fontthumbs import ThumbnailCache
+except ImportError:
+    ThumbnailCache = None
+try:
+    from fontsimilar import SimilarityIndex
+except ImportError:
+    SimilarityIndex = None
+try:
+    from fontfacets import TagFacets
+except ImportError:
+    TagFacets = None
 
 import gi
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, Gio, Pango
+from gi.repository import Gtk, Gio, GLib, Pango
 
 
 class TagFlowbox(Gtk.FlowBox):
 
-    def __init__(self, tag_list=None, add_func=None, rmv_func=None, filter_func=None):
+    def __init__(self, tag_list=None, add_func=None, rmv_func=None, filter_func=None,
+                 collections=None, collection_func=None, rmv_collection_func=None):
         super().__init__()
         self.tag_list = tag_list
         self.add_func = add_func
         self.rmv_func = rmv_func
         self.filter_func = filter_func
+        # buttons of the tags, labeled with their counts by set_counts
+        self.tag_buttons = {}
+        self.counts = {}
 
         self.set_max_children_per_line(10)
         self.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.all_fonts_button = None
         if self.filter_func is not None:
-            self._add_tag_box(label=('All Fonts', self.filter_func))
+            self.all_fonts_button = self._add_tag_box(label=('All Fonts', self.filter_func))
+        # smart collections, saved queries, shown by name
+        for name, query in (collections or {}).items():
+            collection_button = self._add_tag_box(label=(name, collection_func),
+                                                  button=('-', rmv_collection_func))
+            collection_button.set_label(f"\u2605 {name}")
+            collection_button.set_tooltip_text(query)
         for tag in self.tag_list:
-            self._add_tag_box(label=(tag, self.filter_func),
-                              button=('-', self.rmv_func))
+            self.tag_buttons[tag] = self._add_tag_box(label=(tag, self.filter_func),
+                                                      button=('-', self.rmv_func), tag=tag)
         if add_func is not None:
-            self._add_tag_box(label=('+', self.add_func))
+            self._add_tag_box(label=('+', self.add_func), group=2)
+
+    def set_counts(self, counts, sort_by_count=False):
+        '''Shows the number of fonts with each tag, from counts, a dict of tag to count,
+        and sorts the tags by it, most first, if sort_by_count. Tags not in counts are not
+        counted yet, and show no number.'''
+        self.counts = counts
+        for tag, tag_button in self.tag_buttons.items():
+            label = f"{tag} ({counts[tag]})" if tag in counts else tag
+            if tag_button.get_label() != label:
+                tag_button.set_label(label)
+        self.set_sort_func(self.sort_by_count if sort_by_count else None)
+
+    def sort_by_count(self, child1, child2):
+        key1, key2 = (self._get_sort_key(child.get_child()) for child in (child1, child2))
+        return (key1 > key2) - (key1 < key2)
+
+    def _get_sort_key(self, tag_box):
+        # All Fonts and collections first and + last, ties in the order of the tags
+        return (tag_box.group, -self.counts.get(tag_box.tag, 0), tag_box.index)
 
-    def _add_tag_box(self, label, button=None):
+    def _add_tag_box(self, label, button=None, tag=None, group=0):
+        '''Adds box of label, a pair of text and function to call with it when clicked,
+        and of a button with button, a pair like it. Returns the label widget.'''
         tag_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=0)
+        tag_box.tag = tag
+        tag_box.group = 1 if tag is not None else group
+        tag_box.index = len(self.get_children())
         if label[1] is not None:
             tag_label = Gtk.Button(label=label[0])
             tag_label.get_style_context().add_class('small-button')
@@ -42,50 +99,136 @@ class TagFlowbox(Gtk.FlowBox):
             tag_box.pack_end(tag_btn, False, False, 0)
         tag_box.get_style_context().add_class('tag-label')
         self.add(tag_box)
+        return tag_label
 
 
-class FontBox(Gtk.FlowBoxChild):
+class FontCard(Gtk.Box):
+    '''Box with frame with font name, font name in font, and tags of the font.
+    Can be bound to another font, so that it can be recycled.'''
 
-    def __init__(self, parent_window, font_name, font_model):
-        super().__init__()
+    def __init__(self, parent_window, font_model, font_name=None):
+        super().__init__(orientation=Gtk.Orientation.VERTICAL)
         self.parent_window = parent_window
-        self.font_name = font_name
         self.font_model = font_model
-        self.tag_list = font_model.get_font_tags(font_name)
-        self.reload_name()
-        self.add_font_box()
-
-    def reload_name(self):
-        self.set_name(self.font_model.get_font_name_w_tags(self.font_name))
-
-    def add_font_box(self):
-        '''Creates and adds box with frame with font name and font name in font'''
-        new_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        new_frame = Gtk.Frame(label=self.font_name)
-        new_label = Gtk.Label(label=self.font_name)
-        new_label.set_xalign(0)
+        self.font_name = None
+        self.tag_list = []
+        self.tag_flowbox = None
+
+        self.frame = Gtk.Frame()
+        self.frame_label = Gtk.Label()
+        frame_label_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=3)
+        # selects the font for tagging many fonts at once
+        self.select_button = Gtk.CheckButton()
+        self.select_button.set_tooltip_text("Select font")
+        self.select_button.connect('toggled', self.on_select_toggled)
+        frame_label_box.pack_start(self.select_button, False, False, 0)
+        frame_label_box.pack_start(self.frame_label, False, False, 0)
+        if SimilarityIndex is not None:
+            similar_button = Gtk.Button(label="\u2248")
+            similar_button.set_tooltip_text("Show similar fonts")
+            similar_button.get_style_context().add_class('small-button')
+            similar_button.connect(
+                'clicked', lambda button: self.parent_window.show_similar(self.font_name))
+            frame_label_box.pack_start(similar_button, False, False, 0)
+        self.frame.set_label_widget(frame_label_box)
+        self.label = Gtk.Label()
+        self.label.set_xalign(0)
+        self.label.set_ellipsize(Pango.EllipsizeMode.END)
+        # preview rendered by the thumbnail cache, shown instead of the label when there is one
+        self.preview = Gtk.DrawingArea()
+        self.preview.connect('draw', self.draw_preview)
+        self.preview_surface = None
+        preview_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        for widget in (self.label, self.preview):
+            widget.set_no_show_all(True)
+            preview_box.pack_start(widget, True, True, 0)
+        self.frame.add(preview_box)
+        self.frame.set_size_request(120, 60)
+        self.pack_start(self.frame, False, False, 0)
+        if font_name is not None:
+            self.bind(font_name)
+
+    def bind(self, font_name):
+        '''Shows font_name and its tags in the card.'''
+        self.font_name = font_name
+        self.frame_label.set_text(font_name)
+        self.reload_selected()
+        self.reload_label()
+        self.reload_tag_flowbox()
+
+    def reload_selected(self):
+        '''Checks the select button if the font is selected in the parent window.'''
+        self.select_button.handler_block_by_func(self.on_select_toggled)
+        self.select_button.set_active(self.font_name in self.parent_window.selected_fonts)
+        self.select_button.handler_unblock_by_func(self.on_select_toggled)
+
+    def on_select_toggled(self, button):
+        self.parent_window.select_fonts([self.font_name], button.get_active())
+
+    def reload_label(self):
+        '''Shows the font name or view text in the font, at the view size.
+        Uses the cached preview if there is one, otherwise the plain font name is shown
+        while the preview is loaded or rendered in the background.'''
         disp_text = self.font_name if self.font_model.view_text == "{font_name}" else self.font_model.view_text
-        new_label.set_markup(
+        thumbnails = self.parent_window.thumbnails
+        if thumbnails is None:
+            self.set_label_markup(disp_text)
+            self.show_preview(None)
+            return
+        surface = thumbnails.lookup(self.font_name, self.font_model.view_size, disp_text)
+        if surface is None:
+            self.label.set_text(self.font_name)
+            thumbnails.request(self.font_name, self.font_model.view_size, disp_text,
+                               self.on_preview_rendered)
+        self.show_preview(surface)
+
+    def set_label_markup(self, disp_text):
+        self.label.set_markup(
             f"<span font=\"{self.font_name} {self.font_model.view_size}\">{disp_text}</span>")
-        new_label.set_ellipsize(Pango.EllipsizeMode.END)
-        new_frame.add(new_label)
-        new_frame.set_size_request(120, 60)
-        new_box.pack_start(new_frame, False, False, 0)
-        new_box.pack_start(TagFlowbox(tag_list=self.tag_list,
-                                      add_func=self.add_tag,
-                                      rmv_func=self.rmv_tag),
-                           False, False, 0)
-        self.add(new_box)
+
+    def on_preview_rendered(self, font_name, size, text, surface):
+        '''Swaps in the rendered preview, if the card still shows that font with those settings.
+        If the preview could not be rendered, the label shows the text in the font instead.'''
+        disp_text = self.font_name if self.font_model.view_text == "{font_name}" else self.font_model.view_text
+        if (font_name, size, text) == (self.font_name, self.font_model.view_size, disp_text):
+            if surface is None:
+                self.set_label_markup(disp_text)
+            self.show_preview(surface)
+
+    def show_preview(self, surface):
+        '''Shows preview surface, or the label if surface is None.'''
+        self.preview_surface = surface
+        if surface is not None:
+            self.preview.set_size_request(-1, surface.get_height())
+            self.preview.queue_draw()
+        self.preview.set_visible(surface is not None)
+        self.label.set_visible(surface is None)
+
+    def draw_preview(self, area, cr):
+        '''Paints the preview in the text color of the theme.'''
+        if self.preview_surface is None:
+            return
+        color = area.get_style_context().get_color(area.get_state_flags())
+        cr.set_source_rgba(color.red, color.green, color.blue, color.alpha)
+        top = (area.get_allocated_height() - self.preview_surface.get_height()) / 2
+        cr.mask_surface(self.preview_surface, 0, max(0, top))
 
     def reload_tag_flowbox(self):
-        '''Replaces the old tag flowbox with a newly created tag flowbox,'''
-        box = self.get_children()[0]
-        tag_flowbox = box.get_children()[1]
-        box.remove(tag_flowbox)
-        new_tag_flowbox = TagFlowbox(
+        '''Replaces the old tag flowbox with a newly created tag flowbox.'''
+        self.tag_list = self.font_model.get_font_tags(self.font_name)
+        if self.tag_flowbox is not None:
+            self.remove(self.tag_flowbox)
+            self.tag_flowbox.destroy()
+        self.tag_flowbox = TagFlowbox(
             tag_list=self.tag_list, add_func=self.add_tag, rmv_func=self.rmv_tag)
-        box.pack_start(new_tag_flowbox, False, False, 0)
-        new_tag_flowbox.show_all()
+        self.tag_flowbox.show_all()
+        # visibility follows show_tags, not show_all of the parents
+        self.tag_flowbox.set_no_show_all(True)
+        self.tag_flowbox.set_visible(self.font_model.show_tags)
+        self.pack_start(self.tag_flowbox, False, False, 0)
+
+    def reload_tags_visible(self):
+        self.tag_flowbox.set_visible(self.font_model.show_tags)
 
     def add_tag(self, button, tag):
         '''Creates and shows dialog window for input of tag. 
@@ -93,35 +236,470 @@ class FontBox(Gtk.FlowBoxChild):
         dialogWindow = EntryDialog(
             parent=self.parent_window, title="Add tag",
             prompt="Enter text for tag\nDo not include '{' or '}'",
-            valid_func=lambda x: '{' not in x and '}' not in x)
+            valid_func=lambda x: '{' not in x and '}' not in x,
+            complete_func=lambda x: self.font_model.complete_tag(x, exclude=set(self.tag_list)))
         response, text = dialogWindow.run()
         dialogWindow.destroy()
 
         if (response == Gtk.ResponseType.OK) and (text != ''):
-            if self.font_model.add_tag(self.font_name, text):
-                self.parent_window.reload_tag_flowbox()
-            self.reload_tag_flowbox()
-            self.reload_name()
+            # the parent window reloads the tag flowboxes, see on_tags_changed
+            self.font_model.add_tag(self.font_name, text)
 
     def rmv_tag(self, button, tag):
-        '''Removes tag. Reloads parent window flowbox if needed'''
-        if self.font_model.rmv_tag(self.font_name, tag):
-            self.parent_window.reload_tag_flowbox()
-        self.reload_tag_flowbox()
-        self.reload_name()
+        '''Removes tag. The parent window reloads the tag flowboxes.'''
+        self.font_model.rmv_tag(self.font_name, tag)
+
+
+class FontBox(Gtk.FlowBoxChild):
+
+    def __init__(self, parent_window, font_name, font_model):
+        super().__init__()
+        self.font_name = font_name
+        self.card = FontCard(parent_window, font_model, font_name)
+        self.add(self.card)
+
+
+class VirtualFontGrid(Gtk.Layout):
+    '''Grid of fonts that only has FontCards for the rows in view, plus a few rows of overscan.
+    Cards that scroll out of view are hidden and bound to the fonts scrolling into view.'''
+
+    OVERSCAN_ROWS = 2
+    MIN_CELL_WIDTH = 180
+
+    def __init__(self, parent_window, font_model, fonts):
+        super().__init__()
+        self.parent_window = parent_window
+        self.font_model = font_model
+        self.fonts = fonts
+        self.cards = {}
+        self.spare_cards = []
+        self.row_height = 0
+        self.width = 0
+        self._updating = False
+        self._update_source = None
+        # the scrolled window's vadjustment, shared with the grid that replaces this one,
+        # and the id of the handler connected to it
+        self._vadjustment = None
+        self._vadjustment_handler = None
+
+        self.connect('notify::vadjustment', self._on_vadjustment_set)
+        self.connect('size-allocate', self._on_size_allocate)
+        self.connect('destroy', self._on_destroy)
+
+    def set_fonts(self, fonts, scroll_to_top=True):
+        '''Shows fonts, in order. Cards of fonts still shown are kept as they are.'''
+        self.fonts = fonts
+        if scroll_to_top:
+            self.get_vadjustment().set_value(0)
+        self.update_view()
+
+    def reload_tags_visible(self):
+        '''Shows or hides the tags of the cards, and measures rows again.'''
+        for card in self.cards.values():
+            card.reload_tags_visible()
+        for card in self.spare_cards:
+            card.reload_tags_visible()
+        self.relayout()
+
+    def reload_labels(self):
+        '''Reloads the labels of the cards in view, and measures rows again.
+        Spare cards get their labels reloaded when they are bound.'''
+        for card in self.cards.values():
+            card.reload_label()
+        self.relayout()
+
+    def relayout(self):
+        '''Measures rows again and moves cards into place, after columns or card contents change.'''
+        self.row_height = 0
+        self.update_view()
+
+    def get_columns(self):
+        if self.font_model.columns != -1:
+            return self.font_model.columns
+        return max(1, min(12, self.width // self.MIN_CELL_WIDTH))
+
+    def queue_update(self):
+        if self._update_source is None:
+            self._update_source = GLib.idle_add(self._idle_update)
+
+    def _idle_update(self):
+        self._update_source = None
+        self.update_view()
+        return GLib.SOURCE_REMOVE
+
+    def _on_vadjustment_set(self, widget, pspec):
+        self._disconnect_vadjustment()
+        self._vadjustment = self.get_vadjustment()
+        if self._vadjustment is not None:
+            self._vadjustment_handler = self._vadjustment.connect(
+                'value-changed', lambda adj: self.update_view())
+
+    def _disconnect_vadjustment(self):
+        if self._vadjustment_handler is not None:
+            self._vadjustment.disconnect(self._vadjustment_handler)
+            self._vadjustment_handler = None
+        self._vadjustment = None
+
+    def _on_destroy(self, widget):
+        self._disconnect_vadjustment()
+        if self._update_source is not None:
+            GLib.source_remove(self._update_source)
+            self._update_source = None
+
+    def _on_size_allocate(self, widget, allocation):
+        if allocation.width != self.width:
+            self.width = allocation.width
+            self.queue_update()
+
+    def _on_card_allocate(self, card, allocation):
+        if allocation.height > self.row_height:
+            self.queue_update()
+
+    def _get_card(self, font_name):
+        if self.spare_cards:
+            card = self.spare_cards.pop()
+            card.bind(font_name)
+            card.show()
+        else:
+            card = FontCard(self.parent_window, self.font_model, font_name)
+            card.connect('size-allocate', self._on_card_allocate)
+            card.show_all()
+            # hidden spare cards must stay hidden when the grid is shown
+            card.set_no_show_all(True)
+            self.put(card, 0, 0)
+        return card
+
+    @fontstats.timed('virtual_grid_update')
+    def update_view(self):
+        '''Binds cards to the fonts of the rows in view and moves them into place.'''
+        if self._updating or self.width == 0:
+            return
+        self._updating = True
+        columns = self.get_columns()
+        cell_width = self.width // columns
+        adjustment = self.get_vadjustment()
+        top, page = adjustment.get_value(), adjustment.get_page_size()
+        if self.row_height == 0 and self.fonts:
+            # measure a first card to know how many rows fit
+            card = next(iter(self.cards.values()), None)
+            if card is None:
+                card = self.cards[self.fonts[0]] = self._get_card(self.fonts[0])
+            self.row_height = self._measure(card, cell_width)
+
+        first_row = max(0, int(top // self.row_height) - self.OVERSCAN_ROWS) if self.fonts else 0
+        last_row = int((top + page) // self.row_height) + 1 + self.OVERSCAN_ROWS if self.fonts else 0
+        in_view = self.fonts[first_row*columns:last_row*columns]
+        in_view_set = set(in_view)
+
+        for font_name in [fn for fn in self.cards if fn not in in_view_set]:
+            card = self.cards.pop(font_name)
+            card.hide()
+            self.spare_cards.append(card)
+        for font_name in in_view:
+            if font_name not in self.cards:
+                self.cards[font_name] = self._get_card(font_name)
+        self.row_height = max([self.row_height] + [self._measure(card, cell_width)
+                                                   for card in self.cards.values()])
+
+        for i, font_name in enumerate(in_view, start=first_row*columns):
+            self.move(self.cards[font_name], (i % columns) * cell_width,
+                      (i // columns) * self.row_height)
+        rows = (len(self.fonts) + columns - 1) // columns
+        self.set_size(self.width, rows * self.row_height)
+        self._updating = False
+
+    def _measure(self, card, cell_width):
+        card.set_size_request(cell_width, -1)
+        return max(1, card.get_preferred_height_for_width(cell_width)[0])
 
 
 class FontWindow(Gtk.ApplicationWindow):
 
-    def __init__(self, *args, filename="tags.json", **kwargs):
+    # catalogs at least this big start with the virtual grid
+    VIRTUAL_GRID_MIN_FONTS = 2000
+    # flowbox children filtered per main loop iteration
+    FILTER_BATCH_SIZE = 500
+    # fonts are loaded in batches for at most this many microseconds per main loop iteration
+    LOAD_SLICE_US = 15000
+    LOAD_BATCH_SIZE = 50
+    # microseconds between refreshes of the virtual grid while fonts load, as each one
+    # filters all fonts loaded so far
+    LOAD_REFRESH_US = 500000
+    # seconds between writes of the tags file, changes are journaled in between
+    AUTOSAVE_INTERVAL = 60
+    # seconds the font directories have to be left alone before fonts are listed again,
+    # so installing a batch of fonts is one update
+    RESCAN_DELAY = 2
+    # settings of the font model kept from one session to the next, see save_session
+    SESSION_SETTINGS = ('show_tags', 'columns', 'view_size', 'view_text', 'virtual_grid',
+                        'sort_tags_by_count')
+    # the search entry shows ALL_FONTS as this, see get_query
+    ALL_FONTS_TEXT = '{All Fonts}'
+
+    def __init__(self, *args, filename="tags.json", backend=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.set_default_size(800, 400)
 
-        self.font_model = FontCatModel(self.list_system_fonts(), filename)
+        # fonts are added after the window is shown, see load_fonts. The tags are locked while
+        # the window is open, so the command line does not change tags the window would write
+        # over, waiting for a command already changing them to finish
+        self.font_model = FontCatModel([], filename, backend, lock='wait')
+        self.font_model.add_listener(self.on_tags_changed)
+        # settings, query and fontconfig fingerprint of the last session, whose fonts are
+        # shown first if it has one, see load_fonts
+        self.session = read_session() or {}
+        for name, value in self.session.get('settings', {}).items():
+            if name in self.SESSION_SETTINGS:
+                setattr(self.font_model, name, value)
+        self.font_fingerprint = self.session.get('fingerprint')
+        self.selected_fonts = set()
+        # if the search entry shows ALL_FONTS, rather than text typed into it, see get_query
+        self._shows_all_fonts = False
+        # fonts added to the model so far, and when the virtual grid is next refreshed,
+        # see load_fonts_slice
+        self.fonts_loaded = 0
+        self._load_refresh_time = 0
+        # fonts whose tag flowboxes need reloading, and if the tag bar does
+        self._changed_fonts = set()
+        self._tags_changed = False
+        self._refresh_source = None
+        # monitors of the font directories
+        self._font_monitors = {}
+        self._rescan_source = None
+        self._rescanning = False
+        self._rescan_pending = False
+        # if fontconfig changed since the fonts shown first were listed, see load_fonts
+        self._font_list_changed = False
+        # background jobs writing an index file, and the arguments to run them again with
+        # once they are done, see start_job
+        self._running_jobs = set()
+        self._pending_jobs = {}
+        self.search = SearchPipeline(self.font_model, self.apply_filter,
+                                     delay=self.font_model.search_delay)
+        self.thumbnails = None
+        if ThumbnailCache is not None and self.font_model.preview_cache:
+            self.thumbnails = ThumbnailCache(on_fonts_changed=self.reload_font_labels)
+            self.connect('destroy', lambda window: self.thumbnails.close())
+
+        if self.font_model.store is not None:
+            GLib.timeout_add_seconds(self.AUTOSAVE_INTERVAL, self.autosave)
+            self.connect('destroy', lambda window: self.font_model.store.close())
+        if fontstats.dump_filename is not None:
+            self.connect('destroy', lambda window: fontstats.dump(fontstats.dump_filename))
+        self.connect('destroy', self.save_session)
 
         self._create_window()
         self._create_actions()
         self.show_all()
+        self.tag_flowbox.set_visible(self.font_model.show_tags)
+        GLib.idle_add(self.load_fonts)
+        self.start_job(self.scan_metadata)
+
+    def scan_metadata(self):
+        '''Reads the facts of new and changed font files in the background, for [fact] queries.
+        The cached facts are used until then.'''
+        index = FontMetaIndex()
+        GLib.idle_add(self.set_font_facts, index.get_family_facts())
+        if index.update():
+            GLib.idle_add(self.set_font_facts, index.get_family_facts())
+
+    def set_font_facts(self, font_facts):
+        self.font_model.set_font_facts(font_facts)
+        query = self.get_query()
+        if '[' in query:
+            self.search.search_now(query)
+        return GLib.SOURCE_REMOVE
+
+    def save_session(self, window):
+        '''Saves the view settings, the query and the fingerprint of fontconfig when the fonts
+        were last listed, for the next start.'''
+        write_session({
+            'settings': {name: getattr(self.font_model, name) for name in self.SESSION_SETTINGS},
+            'query': self.get_query(),
+            'fingerprint': self.font_fingerprint,
+        })
+
+    def load_fonts(self):
+        '''Takes the fonts of the last session, or lists the system fonts if there are none,
+        then adds them to the model and grid a time slice at a time.
+        Either way they are listed again in the background once they are loaded, and the
+        fonts added or removed since are applied, see start_rescan. That is done right away if
+        fontconfig changed since they were listed, otherwise after RESCAN_DELAY, as a font
+        can be installed without changing the fingerprint.'''
+        fingerprint = get_fontconfig_fingerprint()
+        self._font_list_changed = fingerprint != self.font_fingerprint
+        fonts = read_font_list_cache()
+        if fonts is None:
+            self.font_fingerprint = fingerprint
+            self._font_list_changed = False
+            fonts = self.list_system_fonts()
+            # for the command line, which does not load Pango
+            write_font_list_cache(fonts)
+        # the last session's choice is kept, big catalogs only default to the virtual grid
+        if (len(fonts) >= self.VIRTUAL_GRID_MIN_FONTS and not self.font_model.virtual_grid
+                and 'virtual_grid' not in self.session.get('settings', {})):
+            self.font_model.virtual_grid = True
+            self.reload_font_flowbox()
+        self.fonts_loaded = 0
+        GLib.idle_add(self.load_fonts_slice, fonts)
+        return GLib.SOURCE_REMOVE
+
+    def load_fonts_slice(self, fonts):
+        '''Adds the next batches of fonts until the time slice is used up.'''
+        deadline = GLib.get_monotonic_time() + self.LOAD_SLICE_US
+        loaded = self.fonts_loaded
+        while loaded < len(fonts) and GLib.get_monotonic_time() < deadline:
+            batch = fonts[loaded:loaded + self.LOAD_BATCH_SIZE]
+            added = self.font_model.add_fonts(batch)
+            if not self.font_model.virtual_grid:
+                self.add_font_boxes(added, loading=True)
+            loaded += len(batch)
+        self.fonts_loaded = loaded
+        now = GLib.get_monotonic_time()
+        if self.font_model.virtual_grid and (loaded == len(fonts) or
+                                             now >= self._load_refresh_time):
+            self._load_refresh_time = now + self.LOAD_REFRESH_US
+            self.font_grid.set_fonts(self.font_model.get_filtered_fonts(
+                self.get_query()), scroll_to_top=False)
+
+        self.progress_bar.set_fraction(loaded / len(fonts) if fonts else 1)
+        self.progress_bar.set_text(f"Loading fonts {loaded}/{len(fonts)}")
+        if loaded < len(fonts):
+            return GLib.SOURCE_CONTINUE
+        self.progress_bar.hide()
+        query = self.get_query()
+        self.show_tag_counts(query)
+        if query != ALL_FONTS:
+            # ranks the fonts of the last session's query, and shows the matching font boxes,
+            # which are hidden while fonts load, see add_font_boxes
+            self.search.search_now(query)
+        if TagFacets is not None:
+            threading.Thread(target=self.build_facets, args=(self.font_model.get_facet_cells(),),
+                             daemon=True).start()
+        if SimilarityIndex is not None:
+            fonts = list(self.font_model.get_all_fonts())
+            self.start_job(self.build_similarity, fonts)
+        # checks the fonts of the last session, and any installed while they were listed
+        if self._font_list_changed:
+            self.start_rescan()
+        else:
+            self._rescan_source = GLib.timeout_add_seconds(self.RESCAN_DELAY, self.start_rescan)
+        return GLib.SOURCE_REMOVE
+
+    def build_facets(self, cells):
+        '''Fills the facets of the tag bar counts in the background, from the cells of
+        FontCatModel.get_facet_cells.'''
+        facets = TagFacets()
+        facets.fill(cells)
+        GLib.idle_add(self.set_facets, facets)
+
+    def set_facets(self, facets):
+        self.font_model.set_facets(facets)
+        self.show_tag_counts(self.get_query())
+        return GLib.SOURCE_REMOVE
+
+    def start_job(self, job, *args):
+        '''Runs job in the background, or once more with args after its running run, so two
+        runs never write the same index file at once.'''
+        if job in self._running_jobs:
+            self._pending_jobs[job] = args
+        else:
+            self._running_jobs.add(job)
+            threading.Thread(target=self._run_job, args=(job, args), daemon=True).start()
+
+    def _run_job(self, job, args):
+        try:
+            job(*args)
+        finally:
+            GLib.idle_add(self._finish_job, job)
+
+    def _finish_job(self, job):
+        self._running_jobs.discard(job)
+        if job in self._pending_jobs:
+            self.start_job(job, *self._pending_jobs.pop(job))
+        return GLib.SOURCE_REMOVE
+
+    def start_rescan(self):
+        '''Lists the fonts again in the background, or once more after the running listing.'''
+        self._rescan_source = None
+        if self._rescanning:
+            self._rescan_pending = True
+        else:
+            self._rescanning = True
+            threading.Thread(target=self.rescan_fonts, daemon=True).start()
+        return GLib.SOURCE_REMOVE
+
+    def rescan_fonts(self):
+        # before listing, so a change while listing is seen by the next start
+        fingerprint = get_fontconfig_fingerprint()
+        families, dirs = list_font_families()
+        GLib.idle_add(self.apply_font_changes, families, dirs, fingerprint)
+
+    def apply_font_changes(self, families, dirs, fingerprint):
+        '''Watches the font directories, and applies the families added or removed since
+        the fonts were listed.'''
+        self._rescanning = False
+        if families is not None:
+            self.watch_font_dirs(dirs | set(get_font_dirs()))
+            shown = set(self.font_model.get_all_fonts())
+            self.update_fonts(families - shown, shown - families)
+            self.font_fingerprint = fingerprint
+        if self._rescan_pending:
+            self._rescan_pending = False
+            self.start_rescan()
+        return GLib.SOURCE_REMOVE
+
+    def watch_font_dirs(self, dirs):
+        for path in dirs - self._font_monitors.keys():
+            try:
+                monitor = Gio.File.new_for_path(path).monitor_directory(
+                    Gio.FileMonitorFlags.WATCH_MOVES, None)
+            except GLib.Error:
+                continue
+            monitor.connect('changed', self.on_font_dir_changed)
+            self._font_monitors[path] = monitor
+        for path in self._font_monitors.keys() - dirs:
+            self._font_monitors.pop(path).cancel()
+
+    def on_font_dir_changed(self, monitor, file, other_file, event_type):
+        '''Lists the fonts again once the font directories are left alone for RESCAN_DELAY.'''
+        if event_type in (Gio.FileMonitorEvent.CHANGED, Gio.FileMonitorEvent.ATTRIBUTE_CHANGED):
+            # a file being written, or touched, CHANGES_DONE_HINT follows writes
+            return
+        if self._rescan_source is not None:
+            GLib.source_remove(self._rescan_source)
+        self._rescan_source = GLib.timeout_add_seconds(self.RESCAN_DELAY, self.start_rescan)
+
+    @fontstats.timed('update_fonts')
+    def update_fonts(self, added, removed):
+        '''Adds the cards of installed fonts and removes those of uninstalled fonts,
+        leaving the other cards as they are.'''
+        if not added and not removed:
+            return
+        if added:
+            # makes GTK reload fontconfig and Pango, as a settings daemon would
+            Gtk.Settings.get_default().set_property('gtk-fontconfig-timestamp',
+                                                    GLib.get_real_time() // 1000000)
+        removed = set(self.font_model.remove_fonts(removed))
+        added = self.font_model.add_fonts(sorted(added))
+        if self.selected_fonts & removed:
+            self.select_fonts(removed, False)
+        query = self.get_query()
+        if self.font_model.virtual_grid:
+            self.font_grid.set_fonts(self.font_model.get_filtered_fonts(query), scroll_to_top=False)
+        else:
+            if removed:
+                for fb_child in self.flowbox.get_children():
+                    if fb_child.font_name in removed:
+                        fb_child.destroy()
+            self.add_font_boxes(added)
+        self.show_tag_counts(query)
+        write_font_list_cache(self.font_model.get_all_fonts())
+        if added:
+            # facts and similarity of the new fonts, the others are cached
+            self.start_job(self.scan_metadata)
+            if SimilarityIndex is not None:
+                self.start_job(self.build_similarity, list(self.font_model.get_all_fonts()))
 
     def _create_window(self):
         '''Creates the headerbar with custom menu, along with all widgets, and adds them to the window.'''
@@ -143,21 +721,47 @@ class FontWindow(Gtk.ApplicationWindow):
 
         # add search box
         self.search_entry = Gtk.SearchEntry()
-        self.search_entry.connect('search_changed', self.search_flowbox_filter)
-        self.search_entry.set_text('{All Fonts}')
+        self.search_entry.set_tooltip_text(
+            "Font names, {tags} and [facts], combined with & (and), | (or) and ! (not)")
+        self.search_entry.connect('changed', self.search_flowbox_filter)
+        self.search_entry.connect('activate', lambda entry: self.search.search_now(self.get_query()))
+        self.set_query(self.session.get('query', ALL_FONTS))
         vbox.pack_start(self.search_entry, False, False, 6)
 
         # add main flowbox with unique list of tags
-        vbox.pack_start(TagFlowbox(tag_list=self.font_model.get_all_tags(),
-                                   rmv_func=self.remove_tag,
-                                   filter_func=self.flowbox_filter),
-                        False, False, 0)
+        self.tag_flowbox = TagFlowbox(tag_list=self.font_model.get_all_tags(),
+                                      rmv_func=self.remove_tag,
+                                      filter_func=self.flowbox_filter,
+                                      collections=self.font_model.get_collections(),
+                                      collection_func=self.show_collection,
+                                      rmv_collection_func=self.remove_collection)
+        vbox.pack_start(self.tag_flowbox, False, False, 0)
 
         # create scrolling window of all fonts with tags
-        scrolled = Gtk.ScrolledWindow()
-        scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        scrolled.add(self.get_flowbox_of_fonts())
-        vbox.pack_start(scrolled, True, True, 0)
+        self.scrolled = Gtk.ScrolledWindow()
+        self.scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.scrolled.add(self.get_grid_of_fonts())
+        vbox.pack_start(self.scrolled, True, True, 0)
+
+        # tags the selected fonts, shown while fonts are selected
+        self.selection_bar = Gtk.ActionBar()
+        self.selection_label = Gtk.Label()
+        self.selection_bar.pack_start(self.selection_label)
+        for label, callback in (("Clear", lambda button: self.select_fonts(None, False)),
+                                ("Remove Tag", self.rmv_tag_from_selected),
+                                ("Add Tag", self.add_tag_to_selected),
+                                ("Select Shown", self.select_shown)):
+            button = Gtk.Button(label=label)
+            button.connect('clicked', callback)
+            self.selection_bar.pack_end(button)
+        self.selection_bar.show_all()
+        self.selection_bar.set_no_show_all(True)
+        self.selection_bar.hide()
+        vbox.pack_start(self.selection_bar, False, False, 0)
+
+        # shows how many fonts are loaded, until all are
+        self.progress_bar = Gtk.ProgressBar(show_text=True)
+        vbox.pack_start(self.progress_bar, False, False, 0)
 
         self.add(vbox)
 
@@ -167,18 +771,37 @@ class FontWindow(Gtk.ApplicationWindow):
             ('save', self.save_file),
             ('print', self.export_pdf),
             ('hide_tags', self.toggle_tags),
+            ('sort_tags', self.toggle_sort_tags),
+            ('save_collection', self.save_collection),
+            ('virtual_grid', self.toggle_virtual_grid),
             ('set_columns', self.set_columns),
             ('set_size', self.set_size),
             ('set_text', self.set_text),
+            ('show_stats', self.show_stats),
+            ('dump_stats', self.dump_stats),
         ]
         for action_name, callback in actions:
             action = Gio.SimpleAction.new(action_name, None)
             action.connect("activate", callback)
             self.add_action(action)
+        # checked in the menu while timings are collected
+        action = Gio.SimpleAction.new_stateful(
+            'collect_stats', None, GLib.Variant.new_boolean(fontstats.enabled))
+        action.connect('change-state', self.toggle_stats)
+        self.add_action(action)
+        # the stats dialog is not in the menu
+        application = self.get_application()
+        if application is not None:
+            application.set_accels_for_action('win.show_stats', ['<Primary><Shift>t'])
 
     def save_file(self, action, param):
-        '''Calls for the font_model to overwrite the tags file.'''
-        self.font_model.save_file()
+        '''Calls for the font_model to overwrite the tags file, in the background.'''
+        self.font_model.compact()
+
+    def autosave(self):
+        '''Periodically folds the journaled changes into the tags file.'''
+        self.font_model.compact()
+        return GLib.SOURCE_CONTINUE
 
     def export_pdf(self, action, param):
         '''Calls for print operation to be run with current settings.'''
@@ -195,18 +818,71 @@ class FontWindow(Gtk.ApplicationWindow):
         if response == Gtk.ResponseType.OK:
             self.font_model.columns = int(text)
             FontPrint(parent_window=self, font_model=self.font_model,
-                      last_query=self.search_entry.get_text()).run()
+                      last_query=self.get_query()).run()
+
+    def toggle_stats(self, action, value):
+        '''Turns collecting timings of the slow paths on or off.'''
+        fontstats.set_enabled(value.get_boolean())
+        action.set_state(value)
+
+    def build_similarity(self, fonts):
+        '''Draws the sample glyphs of new and changed fonts in the background, for [like=font].
+        The cached vectors are used until then.'''
+        similarity = SimilarityIndex()
+        if len(similarity):
+            GLib.idle_add(self.set_similarity, similarity)
+        if similarity.update(fonts, get_family_mtimes(list_font_files())):
+            GLib.idle_add(self.set_similarity, similarity)
+
+    def set_similarity(self, similarity):
+        self.font_model.set_similarity(similarity)
+        query = self.get_query()
+        if '[' in query:
+            self.search.search_now(query)
+        return GLib.SOURCE_REMOVE
+
+    def show_similar(self, font_name):
+        '''Shows the fonts that look most like font_name, most similar first.'''
+        query = f"[like={font_name}]"
+        self.set_query(query)
+        self.search.search_now(query)
+
+    def sort_font_boxes(self, child1, child2):
+        '''Orders the flowbox by rank in the query, if it ranks fonts, then by list order.'''
+        keys = []
+        for child in (child1, child2):
+            rank = self.font_ranks.get(child.font_name, len(self.font_ranks)) \
+                if self.font_ranks else 0
+            keys.append((rank, self.font_model.get_font_index(child.font_name)))
+        return (keys[0] > keys[1]) - (keys[0] < keys[1])
+
+    def show_stats(self, action, param):
+        dialog = StatsDialog(parent=self)
+        dialog.run()
+        dialog.destroy()
+
+    def dump_stats(self, action, param):
+        save_stats(self)
 
     def toggle_tags(self, action, param):
         '''Makes the tags disappear, for less busy comparison of fonts.'''
         self.font_model.show_tags = not self.font_model.show_tags
-        def toggle(x): return x.show(
-        ) if self.font_model.show_tags else x.hide()
-        font_flowbox = self.get_children()[0].get_children()[
-            2].get_children()[0].get_children()[0]
-        for fb_child in font_flowbox.get_children():
-            toggle(fb_child.get_children()[0].get_children()[1])
-        toggle(self.get_children()[0].get_children()[1])
+        self.tag_flowbox.set_visible(self.font_model.show_tags)
+        if self.font_model.virtual_grid:
+            self.font_grid.reload_tags_visible()
+        else:
+            for fb_child in self.flowbox.get_children():
+                fb_child.card.reload_tags_visible()
+
+    def toggle_sort_tags(self, action, param):
+        '''Sorts the tag bar by the number of shown fonts with each tag, or back by tag.'''
+        self.font_model.sort_tags_by_count = not self.font_model.sort_tags_by_count
+        self.show_tag_counts(self.get_query())
+
+    def toggle_virtual_grid(self, action, param):
+        '''Switches between the flowbox of all fonts and the virtual grid.'''
+        self.font_model.virtual_grid = not self.font_model.virtual_grid
+        self.reload_font_flowbox()
 
     def set_columns(self, action, param):
         dialogWindow = EntryDialog(
@@ -219,12 +895,10 @@ class FontWindow(Gtk.ApplicationWindow):
         response, text = dialogWindow.run()
         dialogWindow.destroy()
         if response == Gtk.ResponseType.OK:
-            if text == 'dynamic':
-                self.font_model.columns = -1
-                self.reload_font_flowbox()
-            else:
-                self.font_model.columns = int(text)
-                self.reload_font_flowbox()
+            columns = -1 if text == 'dynamic' else int(text)
+            if columns != self.font_model.columns:
+                self.font_model.columns = columns
+                self.reload_font_columns()
 
     def set_size(self, action, param):
         dialogWindow = EntryDialog(
@@ -234,9 +908,9 @@ class FontWindow(Gtk.ApplicationWindow):
             valid_func=lambda x: x.isdigit() and int(x) >= 4 and int(x) <= 128)
         response, text = dialogWindow.run()
         dialogWindow.destroy()
-        if response == Gtk.ResponseType.OK:
+        if response == Gtk.ResponseType.OK and int(text) != self.font_model.view_size:
             self.font_model.view_size = int(text)
-            self.reload_font_flowbox()
+            self.reload_font_labels()
 
     def set_text(self, action, param):
         dialogWindow = EntryDialog(
@@ -245,28 +919,35 @@ class FontWindow(Gtk.ApplicationWindow):
             reset="{font_name}")
         response, text = dialogWindow.run()
         dialogWindow.destroy()
-        if response == Gtk.ResponseType.OK:
+        if response == Gtk.ResponseType.OK and text != self.font_model.view_text:
             self.font_model.view_text = text
-            self.reload_font_flowbox()
+            self.reload_font_labels()
 
+    @fontstats.timed('list_system_fonts')
     def list_system_fonts(self):
-        ''' Yield system fonts families using Pango. '''
-        context = self.create_pango_context()
-        return [fam.get_name() for fam in context.list_families()]
+        '''Returns list of system font families, see fontfiles.list_system_fonts.'''
+        return list_system_fonts()
+
+    def get_grid_of_fonts(self):
+        '''Create the virtual grid or flowbox of fonts, depending on the setting.'''
+        if self.font_model.virtual_grid:
+            self.font_grid = VirtualFontGrid(parent_window=self, font_model=self.font_model,
+                                             fonts=self.font_model.get_all_fonts())
+        else:
+            self.font_grid = self.get_flowbox_of_fonts()
+        return self.font_grid
 
+    @fontstats.timed('get_flowbox_of_fonts')
     def get_flowbox_of_fonts(self):
         '''Create flowbox with all of the fonts in their respective boxes.'''
         # make flowbox and set all settings
         self.flowbox = Gtk.FlowBox()
         self.flowbox.set_valign(Gtk.Align.START)
-        if self.font_model.columns == -1:
-            self.flowbox.set_min_children_per_line(1)
-            self.flowbox.set_max_children_per_line(12)
-        else:
-            self.flowbox.set_min_children_per_line(self.font_model.columns)
-            self.flowbox.set_max_children_per_line(self.font_model.columns)
+        self.set_flowbox_columns()
         self.flowbox.set_homogeneous(True)
         self.flowbox.set_selection_mode(Gtk.SelectionMode.NONE)
+        # ranks of the fonts of the last query, see sort_font_boxes
+        self.font_ranks = None
 
         # get each font in its appropriate box
         for fn in self.font_model.get_all_fonts():
@@ -274,53 +955,242 @@ class FontWindow(Gtk.ApplicationWindow):
                              font_name=fn, font_model=self.font_model))
         return self.flowbox
 
+    @fontstats.timed('add_font_boxes')
+    def add_font_boxes(self, font_names, loading=False):
+        '''Adds boxes of fonts to the flowbox, shown if they match the current query.
+        Adding fonts makes the model evaluate the query again over all fonts, so while fonts
+        load the boxes are hidden instead, and the query is run once when loading ends.'''
+        query = self.get_query()
+        if query == ALL_FONTS:
+            matching = None
+        elif loading:
+            matching = ()
+        else:
+            matching = self.font_model.get_matching_fonts(query)
+        for fn in font_names:
+            font_box = FontBox(parent_window=self, font_name=fn, font_model=self.font_model)
+            font_box.show_all()
+            font_box.set_visible(matching is None or fn in matching)
+            self.flowbox.add(font_box)
+
+    def set_flowbox_columns(self):
+        '''Sets the children per line of the font flowbox from the columns setting.'''
+        if self.font_model.columns == -1:
+            self.flowbox.set_min_children_per_line(1)
+            self.flowbox.set_max_children_per_line(12)
+        else:
+            self.flowbox.set_min_children_per_line(self.font_model.columns)
+            self.flowbox.set_max_children_per_line(self.font_model.columns)
+
+    def reload_font_columns(self):
+        '''Applies the columns setting to the current font flowbox or grid.'''
+        if self.font_model.virtual_grid:
+            self.font_grid.relayout()
+        else:
+            self.set_flowbox_columns()
+
+    def reload_font_labels(self):
+        '''Applies the view size and text to the labels of the current font flowbox or grid.'''
+        if self.font_model.virtual_grid:
+            self.font_grid.reload_labels()
+        else:
+            for fb_child in self.flowbox.get_children():
+                fb_child.card.reload_label()
+
+    @fontstats.timed('reload_tag_flowbox')
     def reload_tag_flowbox(self):
         '''Replaces the old tag flowbox with a newly created tag flowbox,'''
-        box = self.get_children()[0]
-        tag_flowbox = box.get_children()[1]
-        box.remove(tag_flowbox)
-        new_tag_flowbox = TagFlowbox(tag_list=self.font_model.get_all_tags(),
-                                     rmv_func=self.remove_tag,
-                                     filter_func=self.flowbox_filter)
-        box.pack_start(new_tag_flowbox, False, False, 0)
-        box.reorder_child(new_tag_flowbox, 1)
-        new_tag_flowbox.show_all()
+        box = self.tag_flowbox.get_parent()
+        box.remove(self.tag_flowbox)
+        self.tag_flowbox = TagFlowbox(tag_list=self.font_model.get_all_tags(),
+                                      rmv_func=self.remove_tag,
+                                      filter_func=self.flowbox_filter,
+                                      collections=self.font_model.get_collections(),
+                                      collection_func=self.show_collection,
+                                      rmv_collection_func=self.remove_collection)
+        box.pack_start(self.tag_flowbox, False, False, 0)
+        box.reorder_child(self.tag_flowbox, 1)
+        self.tag_flowbox.show_all()
+        self.tag_flowbox.set_visible(self.font_model.show_tags)
+        self.show_tag_counts(self.get_query())
+
+    def show_tag_counts(self, query):
+        '''Shows the number of fonts of query with each tag on the tag bar, if they can be counted.'''
+        counts = self.font_model.get_tag_counts(query)
+        if counts is not None:
+            self.tag_flowbox.set_counts(counts, self.font_model.sort_tags_by_count)
 
     def reload_font_flowbox(self):
-        '''Replaces the old font flowbox with a newly created font flowbox.'''
-        box = self.get_children()[0].get_children()[2]
-        font_flowbox = box.get_children()[0]
-        box.remove(font_flowbox)
-        new_font_flowbox = self.get_flowbox_of_fonts()
-        box.add(new_font_flowbox)
-        new_font_flowbox.show_all()
-        self.flowbox_filter(None, self.search_entry.get_text())
+        '''Replaces the old font flowbox or grid with a newly created one.'''
+        old_font_grid = self.scrolled.get_child()
+        self.scrolled.remove(old_font_grid)
+        old_font_grid.destroy()
+        new_font_grid = self.get_grid_of_fonts()
+        self.scrolled.add(new_font_grid)
+        new_font_grid.show_all()
+        self.flowbox_filter(None, self.get_query())
+
+    def show_collection(self, button, name):
+        '''Shows the fonts of smart collection name, whose result the model keeps up to date.'''
+        query = self.font_model.get_collections()[name]
+        self.set_query(query)
+        self.search.search_now(query)
+
+    def save_collection(self, action, param):
+        '''Saves the current search as a smart collection, shown on the tag bar.'''
+        query = self.get_query()
+        dialog_window = EntryDialog(
+            parent=self, title="Save Collection",
+            prompt=f"Enter name for collection of\n{query}",
+            valid_func=lambda x: x != '')
+        response, text = dialog_window.run()
+        dialog_window.destroy()
+        if response == Gtk.ResponseType.OK and text != '':
+            self.font_model.add_collection(text, query)
+            self.reload_tag_flowbox()
+
+    def remove_collection(self, button, name):
+        '''Confirms that user wants to remove smart collection name.
+        If confirmed, removes it in model, and reloads tag flowbox. Tags of fonts are kept.'''
+        if self._confirm(f'This will remove the collection {name}.\n'
+                         'Are you sure you want to continue?'):
+            self.font_model.remove_collection(name)
+            self.reload_tag_flowbox()
 
     def remove_tag(self, button, tag):
         '''Confirms that user wants to remove tag from all entries.
         If confirmed, removes in model, and reloads font & tag flowbox.'''
         if button is not None:
             msg = 'This will remove this tag from all entries.\nAre you sure you want to continue?'
-            d = Gtk.MessageDialog(transient_for=self,
-                                  modal=True,
-                                  message_type=Gtk.MessageType.WARNING,
-                                  buttons=Gtk.ButtonsType.OK_CANCEL,
-                                  text=msg)
-            response = d.run()
-            d.destroy()
-
-            if response == Gtk.ResponseType.OK:
+            if self._confirm(msg):
                 self.font_model.remove_tag_from_all(tag)
-                self.reload_font_flowbox()
-                self.reload_tag_flowbox()
+                self.search.search_now(self.get_query())
+
+    def _confirm(self, msg):
+        d = Gtk.MessageDialog(transient_for=self,
+                              modal=True,
+                              message_type=Gtk.MessageType.WARNING,
+                              buttons=Gtk.ButtonsType.OK_CANCEL,
+                              text=msg)
+        response = d.run()
+        d.destroy()
+        return response == Gtk.ResponseType.OK
+
+    def iter_cards(self):
+        '''Yields the FontCards bound to fonts.'''
+        if self.font_model.virtual_grid:
+            yield from self.font_grid.cards.values()
+        else:
+            for fb_child in self.flowbox.get_children():
+                yield fb_child.card
+
+    def on_tags_changed(self, font_names, tags_changed):
+        '''Reloads the tag flowboxes of font_names, and the tag bar if tags_changed,
+        once per main loop iteration however many changes come in.'''
+        self._changed_fonts |= font_names
+        self._tags_changed = self._tags_changed or tags_changed
+        if self._refresh_source is None:
+            self._refresh_source = GLib.idle_add(self.refresh_changed)
+
+    def refresh_changed(self):
+        self._refresh_source = None
+        if self._tags_changed:
+            self.reload_tag_flowbox()
+        elif self._changed_fonts:
+            self.show_tag_counts(self.get_query())
+        for card in self.iter_cards():
+            if card.font_name in self._changed_fonts:
+                card.reload_tag_flowbox()
+        if self.font_model.virtual_grid and self._changed_fonts:
+            self.font_grid.relayout()
+        self._changed_fonts = set()
+        self._tags_changed = False
+        return GLib.SOURCE_REMOVE
+
+    def select_fonts(self, font_names, selected):
+        '''Selects or deselects font_names, or all fonts if font_names is None.'''
+        # a set, as it is tested against every card
+        font_names = set(self.selected_fonts if font_names is None else font_names)
+        if selected:
+            self.selected_fonts.update(font_names)
+        else:
+            self.selected_fonts.difference_update(font_names)
+        for card in self.iter_cards():
+            if card.font_name in font_names:
+                card.reload_selected()
+        self.selection_label.set_text(f"{len(self.selected_fonts)} fonts selected")
+        self.selection_bar.set_visible(bool(self.selected_fonts))
+
+    def select_shown(self, button):
+        '''Selects all fonts of the current query.'''
+        self.select_fonts(self.font_model.get_filtered_fonts(self.get_query()), True)
+
+    def _ask_tag(self, title):
+        dialog_window = EntryDialog(
+            parent=self, title=title,
+            prompt=f"Enter text for tag of {len(self.selected_fonts)} fonts\n"
+                   "Do not include '{' or '}'",
+            valid_func=lambda x: x != '' and '{' not in x and '}' not in x,
+            complete_func=self.font_model.complete_tag)
+        response, text = dialog_window.run()
+        dialog_window.destroy()
+        return text if response == Gtk.ResponseType.OK else None
+
+    def add_tag_to_selected(self, button):
+        '''Adds a tag to all selected fonts, as one change.'''
+        tag = self._ask_tag("Add tag")
+        if tag is not None:
+            self.font_model.add_tag_to_fonts(sorted(self.selected_fonts), tag)
+
+    def rmv_tag_from_selected(self, button):
+        '''Removes a tag from all selected fonts, as one change.'''
+        tag = self._ask_tag("Remove tag")
+        if tag is not None:
+            self.font_model.rmv_tag_from_fonts(sorted(self.selected_fonts), tag)
+
+    def get_query(self):
+        '''Returns the query of the search entry, which shows ALL_FONTS as {All Fonts}.
+        Typing {All Fonts} is a query of the tag All Fonts.'''
+        if self._shows_all_fonts:
+            return ALL_FONTS
+        return self.search_entry.get_text()
+
+    def set_query(self, query):
+        '''Shows query in the search entry, without searching it.'''
+        self._shows_all_fonts = query == ALL_FONTS
+        self.search_entry.handler_block_by_func(self.search_flowbox_filter)
+        self.search_entry.set_text(self.ALL_FONTS_TEXT if query == ALL_FONTS else query)
+        self.search_entry.handler_unblock_by_func(self.search_flowbox_filter)
 
     def search_flowbox_filter(self, search_entry):
-        '''When search entry text is changed, filter flowbox with text.'''
-        self.flowbox_filter(None, search_entry.get_text())
+        '''When search entry text is changed, filter flowbox with text once typing pauses.'''
+        self._shows_all_fonts = False
+        self.search.search(self.get_query())
 
     def flowbox_filter(self, button, filter_text):
         '''Fixes format when button clicked and filters flowbox with search text.'''
-        if button is not None or filter_text == '{All Fonts}':
-            filter_text = "{" + filter_text + '}'
-            self.search_entry.set_text(filter_text)
-        self.flowbox.set_filter_func(FontCatModel.filter_func, filter_text)
+        if button is not None:
+            if button is self.tag_flowbox.all_fonts_button:
+                filter_text = ALL_FONTS
+            else:
+                filter_text = "{" + filter_text + '}'
+            self.set_query(filter_text)
+        self.search.search_now(filter_text)
+
+    def apply_filter(self, query, fonts):
+        '''Shows only fonts of the query result. Yields between batches of flowbox children,
+        so a newer query can replace the pass before it is done.'''
+        self.show_tag_counts(query)
+        if self.font_model.virtual_grid:
+            self.font_grid.set_fonts(self.font_model.get_filtered_fonts(query))
+            return
+        ranks = self.font_model.get_font_ranks(query)
+        if ranks is not None or self.font_ranks is not None:
+            # the flowbox is only sorted once a query ranks fonts
+            self.font_ranks = ranks
+            self.flowbox.set_sort_func(self.sort_font_boxes)
+        children = self.flowbox.get_children()
+        for start in range(0, len(children), self.FILTER_BATCH_SIZE):
+            for fb_child in children[start:start + self.FILTER_BATCH_SIZE]:
+                fb_child.set_visible(fb_child.font_name in fonts)
+            yield
@@ -0,0 +1,37 @@
+import pytest
+
+from fontnames import NameIndex
+
+FONTS = ['Roboto', 'Roboto Mono', 'Open Sans', 'Noto Sans', 'Source Sans Pro']
+
+
+@pytest.fixture
+def names():
+    index = NameIndex()
+    for font_id, font_name in enumerate(FONTS):
+        index.add(font_id, font_name)
+    return index
+
+
+def ranked(names, text):
+    scores = names.search(text)
+    return [FONTS[font_id] for font_id in sorted(scores, key=lambda font_id: -scores[font_id])]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('rob', ['Roboto', 'Roboto Mono']),
+    ('roboto mono', ['Roboto Mono']),
+    ('mono robo', ['Roboto Mono']),
+    # typos: a swapped pair and a missing letter
+    ('opne sans', ['Open Sans']),
+    ('robto', ['Roboto', 'Roboto Mono']),
+    ('xyz', []),
+    ('', []),
+])
+def test_search(names, text, expected):
+    assert ranked(names, text) == expected
+
+
+def test_remove(names):
+    names.remove(0)
+    assert ranked(names, 'roboto') == ['Roboto Mono']
@@ -0,0 +1,50 @@
+import pytest
+
+from fontquery import (ALL_FONTS, And, Fact, MatchAll, MatchNone, Name, Not, Or, QueryError, Tag,
+                       compile_query, parse_query)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{a}', Tag('a')),
+    (ALL_FONTS, MatchAll()),
+    # ! binds tighter than &, which binds tighter than |
+    ('{a} | {b} & !{c}', Or([Tag('a'), And([Tag('b'), Not(Tag('c'))])])),
+    ('!{a} & {b} | {c}', Or([And([Not(Tag('a')), Tag('b')]), Tag('c')])),
+    ('!!{a}', Not(Not(Tag('a')))),
+    ('({a} | {b}) & {c}', And([Or([Tag('a'), Tag('b')]), Tag('c')])),
+    ('!({a} | {b})', Not(Or([Tag('a'), Tag('b')]))),
+    ('not {a} and {b} or {c}', Or([And([Not(Tag('a')), Tag('b')]), Tag('c')])),
+    # runs of the same operator are flattened
+    ('{a} & {b} & {c}', And([Tag('a'), Tag('b'), Tag('c')])),
+    ('{a} | ({b} | {c})', Or([Tag('a'), Tag('b'), Tag('c')])),
+    ('[weight>=bold] & open sans', And([Fact('weight', '>=', 700), Name('open sans')])),
+    ('"open sans" | {b}', Or([Name('open sans'), Tag('b')])),
+])
+def test_parse_query(text, expected):
+    assert parse_query(text) == expected
+
+
+def test_and_or_ignore_order():
+    assert parse_query('{a} & {b}') == parse_query('{b} & {a}')
+    assert parse_query('{a} | {b}') == parse_query('{b} | {a}')
+
+
+@pytest.mark.parametrize('text, tags, matches', [
+    ('{a} | {b} & !{c}', {'a', 'c'}, True),
+    ('{a} | {b} & !{c}', {'b', 'c'}, False),
+    ('({a} | {b}) & !{c}', {'b'}, True),
+    ('!{a}', set(), True),
+    ('[italic]', {'italic'}, False),
+])
+def test_matches(text, tags, matches):
+    assert parse_query(text).matches(tags) == matches
+
+
+@pytest.mark.parametrize('text', [
+    '', '{a', '[italic', '"open', '}', ']', 'abc]', '{a}}', '({a}', '{a})', '{a} &', '& {a}',
+    '!', '()', '[wieght>=700]', '[weight]', '[italic=yes]', '[covers=U+zz]',
+])
+def test_invalid_queries(text):
+    with pytest.raises(QueryError):
+        parse_query(text)
+    assert isinstance(compile_query(text), MatchNone)
@@ -0,0 +1,145 @@
+import json
+
+import pytest
+
+from fontmodel import FontCatModel
+from fontstore import JsonStore, SnapshotStore, StoreLockedError, _Snapshot, write_snapshot
+
+FONTS = ['Arial', 'Courier', 'Garamond', 'Helvetica']
+
+
+def tags_of(filename, backend=None):
+    model = FontCatModel(FONTS, filename, backend)
+    tags = {font: list(model.get_font_tags(font)) for font in FONTS}
+    model.store.close()
+    return tags
+
+
+def write_tags(model):
+    model.add_tag('Arial', 'sans')
+    model.add_tag_to_fonts(['Courier', 'Garamond'], 'serif')
+    model.add_tag('Helvetica', 'sans')
+    model.rmv_tag('Garamond', 'serif')
+    model.add_tag('Garamond', 'old')
+
+
+EXPECTED = {'Arial': ['sans'], 'Courier': ['serif'], 'Garamond': ['old'], 'Helvetica': ['sans']}
+
+
+def test_journal_is_replayed(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    model = FontCatModel(FONTS, filename)
+    write_tags(model)
+    model.store.close()
+    assert not (tmp_path / 'tags.json').exists()
+    assert tags_of(filename) == EXPECTED
+
+
+def test_compaction_empties_journal(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    model = FontCatModel(FONTS, filename)
+    write_tags(model)
+    model.compact()
+    model.store.wait()
+    model.add_tag('Arial', 'grotesque')
+    model.store.close()
+    with open(filename) as tags_file:
+        assert json.load(tags_file)['sans'] == ['Arial', 'Helvetica']
+    with open(filename + '.journal') as journal_file:
+        assert [json.loads(line) for line in journal_file] == [['add_many', ['Arial'], 'grotesque']]
+    assert not (tmp_path / 'tags.json.journal.old').exists()
+    assert tags_of(filename) == dict(EXPECTED, Arial=['sans', 'grotesque'])
+
+
+def test_unfinished_compaction_keeps_both_journals(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    model = FontCatModel(FONTS, filename)
+    model.add_tag('Arial', 'sans')
+    # moved aside, but the tags file was never written
+    model.store._rotate_journal()
+    model.add_tag('Courier', 'serif')
+    model.store.close()
+    assert tags_of(filename) == dict.fromkeys(FONTS, []) | {'Arial': ['sans'], 'Courier': ['serif']}
+
+
+def test_torn_journal_record_is_skipped(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    model = FontCatModel(FONTS, filename)
+    model.add_tag('Arial', 'sans')
+    model.store.close()
+    with open(filename + '.journal', 'a') as journal_file:
+        journal_file.write('["add_many", ["Cour')
+    assert tags_of(filename) == dict.fromkeys(FONTS, []) | {'Arial': ['sans']}
+
+
+def test_lock(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    store = JsonStore(filename)
+    store.lock()
+    with pytest.raises(StoreLockedError):
+        FontCatModel(FONTS, filename, lock=True)
+    store.close()
+    FontCatModel(FONTS, filename, lock=True).store.close()
+
+
+def write_json(filename, tags_list):
+    with open(filename, 'w') as tags_file:
+        json.dump(tags_list, tags_file)
+
+
+def test_snapshot_round_trip(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    model = FontCatModel(FONTS, filename, 'snapshot')
+    write_tags(model)
+    model.save_file()
+    model.store.close()
+    assert (tmp_path / 'tags.json.snap').exists()
+    assert tags_of(filename, 'snapshot') == EXPECTED
+    assert tags_of(filename, 'json') == EXPECTED
+
+
+def test_snapshot_of_changed_tags_file_is_written_again(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    write_json(filename, {'sans': ['Arial']})
+    store = SnapshotStore(filename)
+    assert store.get_tags() == ['sans']
+    store.close()
+    write_json(filename, {'serif': ['Courier', 'Garamond']})
+    store = SnapshotStore(filename)
+    assert store.get_tags() == ['serif']
+    assert store.get_tag_fonts('serif') == ['Courier', 'Garamond']
+    store.close()
+
+
+def test_corrupt_snapshot_is_written_again(tmp_path):
+    filename = str(tmp_path / 'tags.json')
+    write_json(filename, {'sans': ['Arial', 'Helvetica']})
+    SnapshotStore(filename).close()
+    snapshot = tmp_path / 'tags.json.snap'
+    data = bytearray(snapshot.read_bytes())
+    data[-1] ^= 0xff
+    snapshot.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match='corrupt'):
+        _Snapshot(str(snapshot))
+    assert tags_of(filename, 'snapshot') == dict.fromkeys(FONTS, []) | {
+        'Arial': ['sans'], 'Helvetica': ['sans']}
+    _Snapshot(str(snapshot)).close()
+
+
+@pytest.mark.parametrize('contents', [b'', b'FCATSNAP', b'not a snapshot at all' * 4])
+def test_invalid_snapshot(tmp_path, contents):
+    snapshot = tmp_path / 'tags.snap'
+    snapshot.write_bytes(contents)
+    with pytest.raises(ValueError):
+        _Snapshot(str(snapshot))
+
+
+def test_snapshot_lookups(tmp_path):
+    filename = str(tmp_path / 'tags.snap')
+    write_snapshot(filename, {'sans': ['Helvetica', 'Arial'], 'mono': ['Courier']})
+    snapshot = _Snapshot(filename)
+    assert snapshot.tags == ['sans', 'mono']
+    assert snapshot.get_font_name(snapshot.find_font('Courier')) == 'Courier'
+    assert snapshot.find_font('Garamond') is None
+    assert snapshot.count(snapshot.tag_ids['sans']) == 2
+    snapshot.close()